@@ -5,9 +5,16 @@ import pika
 import json
 import base64
 import logging
+import itertools
 import functools
 import threading
 import traceback
+import concurrent.futures
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 class BytesEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -20,6 +27,25 @@ def as_bytes(dct):
         return base64.b64decode(dct['__value__'].encode('utf-8'))
     return dct
 
+JSON_CONTENT_TYPE = 'text/json'
+BINARY_CONTENT_TYPE = 'application/msgpack'
+
+# Requests are encoded as MessagePack, which carries bytes without base64,
+# unless ENVELOPE is json; requests are decoded by their content type, so
+# set json until every service of a deployment reads MessagePack
+ENVELOPE = os.environ.get('ENVELOPE', 'binary')
+CONTENT_TYPE = BINARY_CONTENT_TYPE if ENVELOPE != 'json' and msgpack else JSON_CONTENT_TYPE
+
+def encode_body(request, content_type=CONTENT_TYPE):
+    if content_type == BINARY_CONTENT_TYPE:
+        return msgpack.packb(request, use_bin_type=True)
+    return json.dumps(request, cls=BytesEncoder).encode('utf-8')
+
+def decode_body(body, content_type=JSON_CONTENT_TYPE):
+    if content_type == BINARY_CONTENT_TYPE:
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return json.loads(body.decode('utf-8'), object_hook=as_bytes)
+
 LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name)s %(funcName)s %(lineno)d: %(message)s')
 LOGGER = logging.getLogger(__name__)
 
@@ -33,7 +59,28 @@ CONNECTION_PARAMETERS = pika.ConnectionParameters(
     retry_delay=5,
     heartbeat=0,)
 
-RPC_TIMEOUT_IN_SECONDS = 4
+# Seconds to wait for the response to a remote procedure call
+RPC_TIMEOUT_IN_SECONDS = float(os.environ.get('RPC_TIMEOUT', 4))
+# Worker threads executing actions, 0 executes them on the connection thread
+SERVICE_WORKERS = int(os.environ.get('SERVICE_WORKERS', 0))
+# Handled requests are acknowledged together once this many are pending, or
+# the oldest waited this long; 1 acknowledges every request on its own
+ACK_BATCH = int(os.environ.get('ACK_BATCH', 1))
+ACK_DELAY_IN_SECONDS = float(os.environ.get('ACK_DELAY_MS', 50)) / 1000
+# Requests delivered ahead of acknowledgements, 0 for no limit; room for two
+# batches keeps requests coming while one waits for its acknowledgement
+PREFETCH_COUNT = int(os.environ.get('PREFETCH_COUNT',
+                                    2 * SERVICE_WORKERS + (2 * ACK_BATCH if ACK_BATCH > 1 else 0)))
+
+# Published requests are buffered and flushed once per consumed request,
+# or earlier when this many are buffered or the oldest waited this long
+PUBLISH_BATCH = int(os.environ.get('PUBLISH_BATCH', 100))
+PUBLISH_DELAY_IN_SECONDS = float(os.environ.get('PUBLISH_DELAY_MS', 10)) / 1000
+# Flushed requests are committed in one transaction, returning once the broker has them
+PUBLISH_CONFIRMS = os.environ.get('PUBLISH_CONFIRMS', 'false').lower() == 'true'
+
+# RabbitMQ direct reply-to, responses come back on the channel of the caller
+REPLY_QUEUE = 'amq.rabbitmq.reply-to'
 
 class AbstractService(threading.Thread):
 
@@ -44,7 +91,29 @@ class AbstractService(threading.Thread):
         self._closing = False
         self._consumer_tag = None
         self._consuming = False
-        self._prefetch_count = 1
+        self._prefetch_count = PREFETCH_COUNT
+        # Single thread executors, requests of one correlation id go to one of them
+        self._workers = [concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                         for _ in range(SERVICE_WORKERS)]
+        # Requests waiting to be published, with the time the first one was buffered
+        self._outbox = []
+        self._outbox_time = 0
+        self._outbox_lock = threading.Lock()
+        self._publish_channel = None
+        self._confirms = PUBLISH_CONFIRMS
+        # Delivery tags handled out of order with whether they are to be
+        # acknowledged, the last tag handled with all tags before it, the
+        # last of those to acknowledge, the last tag settled and when the
+        # oldest unsettled one was handled
+        self._ack_batch = ACK_BATCH
+        self._handled = {}
+        self._handled_tag = 0
+        self._ack_tag = 0
+        self._acked_tag = 0
+        self._ack_time = 0
+        # Pending remote procedure calls by message id, with their correlation id
+        self._calls = {}
+        self._call_ids = itertools.count(1)
         self.dummy_messenger = None
         self._lock = threading.Lock()
         self._lock.acquire()
@@ -66,6 +135,19 @@ class AbstractService(threading.Thread):
             result = self._channel.queue_declare(queue='', exclusive=True)
             self._queue = result.method.queue
         LOGGER.info('Connected to AMQT Server. Queue name: %s', self._queue)
+        if self._prefetch_count:
+            self._channel.basic_qos(prefetch_count=self._prefetch_count)
+
+        # Receive responses to remote procedure calls
+        self._channel.basic_consume(queue=REPLY_QUEUE,
+                                    on_message_callback=self.on_response,
+                                    auto_ack=True)
+
+        # Publish requests in transactions on their own channel with confirms
+        self._publish_channel = self._channel
+        if self._confirms:
+            self._publish_channel = self._connection.channel()
+            self._publish_channel.tx_select()
 
         # Enable publishing 
         self._lock.release()
@@ -86,8 +168,7 @@ class AbstractService(threading.Thread):
         if not body: return None, None
 
         # Decode request
-        request_string = body.decode('utf-8')
-        request = json.loads(request_string, object_hook=as_bytes)
+        request = decode_body(body, properties.content_type)
         return request, properties.correlation_id
 
     # Overriding thread method run() executing when thread starts                       // abstract_service.py
@@ -96,41 +177,109 @@ class AbstractService(threading.Thread):
         # Connect to AMQP server
         self.connect()
 
-        # Get request from AMQP queue, blocking with 10s timeout
-        for method, properties, body in self._channel.consume(self._queue, inactivity_timeout=10):
+        # Get request from AMQP queue, blocking with 10s timeout, or until
+        # batched acknowledgements are due
+        timeout = min(10, ACK_DELAY_IN_SECONDS) if self._ack_batch > 1 else 10
+        for method, properties, body in self._channel.consume(self._queue, inactivity_timeout=timeout):
 
             # Process request if arrived
             if bool(method or properties or body):
-
-                # Decode request
-                request_string = body.decode('utf-8')
-                request = json.loads(request_string, object_hook=as_bytes)
-                LOGGER.info('Received request: %s', request_string)
-
-                # Extract command from request, get service action from self.actions (overriden by child class)
-                command = request.get('command')
-                action = self.actions.get(command)
-                if not action: continue
-                del request['command']
-
-                # Executing actions safely, methods defined by child class
-                try:
-                    self.prepare_action(request, properties)
-                    response = action(request, properties)
-                    self.reply_to_sender(response, properties)
-                except Exception as e:
-                    LOGGER.error(traceback.format_exc())
-
-                # Sending message acknowledgement to RabbitMQ server
-                self._channel.basic_ack(method.delivery_tag)
+                if self._workers:
+                    # Requests of one client stay in order, other clients run in parallel
+                    worker = self._workers[hash(properties.correlation_id) % len(self._workers)]
+                    worker.submit(self.execute, body, properties, method)
+                else:
+                    self.execute(body, properties, method)
+
+            # Publish requests of this iteration together, acknowledge
+            # requests waiting too long
+            self.flush()
+            self.flush_acks()
 
             # Cancel connection and stop thread if interrupted
-            if self._closing: 
+            if self._closing:
                 self._channel.cancel()
                 break
-         
+
+        # Let workers finish their requests while their calls and publishes
+        # are still served here, then send the last replies and acknowledgements
+        drained = [worker.submit(lambda: None) for worker in self._workers]
+        while not all(future.done() for future in drained):
+            self._connection.process_data_events(time_limit=0.1)
+        for worker in self._workers:
+            worker.shutdown()
+        self._connection.process_data_events()
+        self.flush()
+        self.flush_acks(force=True)
+
+    # Executing actions safely, methods defined by child class; requests
+    # without action are acknowledged, failed requests are requeued once
+    # and dropped when they fail again
+    def execute(self, body, properties, method):
+        failed = False
+        try:
+            # Decode request
+            request = decode_body(body, properties.content_type)
+            LOGGER.info('Received request: %s', request)
+
+            # Extract command from request, get service action from self.actions (overriden by child class)
+            command = request.get('command')
+            action = self.actions.get(command)
+            if action:
+                del request['command']
+                self.prepare_action(request, properties)
+                response = action(request, properties)
+                self.reply_to_sender(response, properties)
+        except Exception as e:
+            LOGGER.error(traceback.format_exc())
+            failed = True
+
+        # Sending message acknowledgement to RabbitMQ server, from the connection thread
+        complete = functools.partial(self.complete, method.delivery_tag, failed, not method.redelivered)
+        if threading.currentThread().getName() != self.getName():
+            self._connection.add_callback_threadsafe(complete)
+        else:
+            complete()
+
+    # Replies of a handled request are published before it is acknowledged,
+    # a failed request is rejected instead
+    def complete(self, delivery_tag, failed=False, requeue=True):
+        self.flush()
+        if failed:
+            self._channel.basic_nack(delivery_tag, requeue=requeue)
+        self.acknowledge(delivery_tag, not failed)
+
+    # Acknowledge handled requests, with batching up to the last one handled
+    # with all requests before it, as workers finish out of order; rejected
+    # requests only count as handled
+    def acknowledge(self, delivery_tag, ack=True):
+        if self._ack_batch <= 1:
+            if ack: self._channel.basic_ack(delivery_tag)
+            return
+        pending = self._handled_tag > self._acked_tag
+        self._handled[delivery_tag] = ack
+        while self._handled_tag + 1 in self._handled:
+            self._handled_tag += 1
+            if self._handled.pop(self._handled_tag): self._ack_tag = self._handled_tag
+        if not pending and self._handled_tag > self._acked_tag:
+            self._ack_time = time.monotonic()
+        self.flush_acks()
+
+    # Acknowledge pending requests at once when enough of them wait, the
+    # oldest waited long enough or forced
+    def flush_acks(self, force=False):
+        pending = self._handled_tag - self._acked_tag
+        if pending <= 0: return
+        if (force or pending >= self._ack_batch
+                or time.monotonic() - self._ack_time >= ACK_DELAY_IN_SECONDS):
+            # Requests rejected in between are settled already
+            if self._ack_tag > self._acked_tag:
+                self._channel.basic_ack(self._ack_tag, multiple=True)
+            self._acked_tag = self._handled_tag
+
     # Publish request to service queue                         // abstract_service.py
-    def publish(self, request, queue, correlation_id=None, reply_queue=None):
+    def publish(self, request, queue, correlation_id=None, reply_queue=None, content_type=CONTENT_TYPE,
+                message_id=None):
         if self.dummy_messenger:
             self.dummy_messenger.publish(request, queue, correlation_id)
             return
@@ -140,63 +289,102 @@ class AbstractService(threading.Thread):
         self._lock.release()
 
         # Prepare request
-        request_string = json.dumps(request, cls=BytesEncoder)
-        body = request_string.encode('utf-8')
+        body = encode_body(request, content_type)
         properties = pika.BasicProperties(
-            content_type='text/json', 
+            content_type=content_type,
             reply_to=reply_queue or self._queue,
-            correlation_id=correlation_id,)
-        LOGGER.info('Publishing on queue: %s, request: %s', queue, request_string)
-
-        # Create method object from RabbitMQ basic publish with ready parameters
-        publish_method = functools.partial(self._channel.basic_publish,
-            exchange='',
-            routing_key=queue,
-            body=body,
-            properties=properties)
-
-        if self.is_alive() and threading.currentThread().getName() != self.getName():
-            # Execute method from another thread
-            self._connection.add_callback_threadsafe(publish_method)
-        else:
-            # Execute method directly
-            publish_method()
+            correlation_id=correlation_id,
+            message_id=message_id,)
+        LOGGER.info('Publishing on queue: %s, request: %s', queue, request)
+
+        with self._outbox_lock:
+            self._outbox.append((queue, body, properties))
+            first = len(self._outbox) == 1
+            if first: self._outbox_time = time.monotonic()
+            full = (len(self._outbox) >= PUBLISH_BATCH
+                    or time.monotonic() - self._outbox_time >= PUBLISH_DELAY_IN_SECONDS)
+
+        if not self.is_alive():
+            # No consumer loop to flush later
+            self.flush()
+        elif threading.currentThread().getName() != self.getName():
+            # Flush from the connection thread, once for all requests buffered until then
+            if first: self._connection.add_callback_threadsafe(self.flush)
+        elif full:
+            self.flush()
+
+    # Publish buffered requests, on the connection thread; calls go out on the
+    # channel receiving their responses, after the requests buffered before them
+    def flush(self):
+        with self._outbox_lock:
+            outbox, self._outbox = self._outbox, []
+        uncommitted = False
+        for queue, body, properties in outbox:
+            channel = self._publish_channel
+            if properties.reply_to == REPLY_QUEUE:
+                if uncommitted: self._publish_channel.tx_commit()
+                uncommitted = False
+                channel = self._channel
+            else:
+                uncommitted = self._confirms
+            channel.basic_publish(exchange='', routing_key=queue, body=body, properties=properties)
+        if uncommitted: self._publish_channel.tx_commit()
 
     # Remote procedure call to service                   // abstract_service.py
-    def rpc(self, request, queue, correlation_id=None):
+    def rpc(self, request, queue, correlation_id=None, timeout=None):
         if self.dummy_messenger:
             return self.dummy_messenger.rpc(request, queue, correlation_id)
-
-        # Creating a temporary queue for receiving result of request
-        result = self._channel.queue_declare(queue='', exclusive=True)
-        temp_queue = result.method.queue
-
-        # Publish request to service with temporary queue to respond to 
-        self.publish(request, queue, correlation_id, temp_queue)
-
-        # Poll temporary queue for response until timeout expires
-        body = None
-        for i in range(RPC_TIMEOUT_IN_SECONDS * 5):
-            time.sleep(0.2)
-            method, properties, body = self._channel.basic_get(temp_queue)
-            if body: break
-        if not body:
+        if timeout is None: timeout = RPC_TIMEOUT_IN_SECONDS
+
+        # Response is matched to the call by the message id it echoes
+        message_id = str(next(self._call_ids))
+        future = concurrent.futures.Future()
+        self._calls[message_id] = (correlation_id, future)
+        try:
+            self.publish(request, queue, correlation_id, REPLY_QUEUE, message_id=message_id)
+            if self.is_alive() and threading.currentThread().getName() != self.getName():
+                # Consumer thread publishes the call and delivers the response
+                response = future.result(timeout)
+            else:
+                # Deliver events until the response arrives
+                self.flush()
+                deadline = time.monotonic() + timeout
+                while not future.done() and time.monotonic() < deadline:
+                    self._connection.process_data_events(time_limit=deadline - time.monotonic())
+                response = future.result(0)
+        except concurrent.futures.TimeoutError:
             raise Exception("Timeout expired. Service %s not available" % queue)
-
-        # Decode response
-        response_string = body.decode('utf-8')
-        response = json.loads(response_string, object_hook=as_bytes)
-        LOGGER.info('Received request: %s', response_string)
+        finally:
+            self._calls.pop(message_id, None)
+        LOGGER.info('Received response: %s', response)
         return response
 
+    # Complete the pending call of a response, services that do not echo the
+    # message id are matched by correlation id; late responses are dropped
+    def on_response(self, channel, method, properties, body):
+        call = self._calls.pop(properties.message_id, None) if properties.message_id else None
+        if call is None:
+            for message_id, (correlation_id, future) in list(self._calls.items()):
+                if correlation_id == properties.correlation_id:
+                    call = self._calls.pop(message_id, None)
+                    break
+        if call is None:
+            LOGGER.info('Dropping response to expired call %s', properties.message_id)
+            return
+        call[1].set_result(decode_body(body, properties.content_type))
+
     def prepare_action(self, request, properties):
         pass
 
+    # Reply in the envelope of the request, understood by the sender
     def reply_to_sender(self, response, properties):
         if response:
-            self.publish(request=response, 
-                         queue=properties.reply_to, 
-                         correlation_id=properties.correlation_id,)
+            self.publish(request=response,
+                         queue=properties.reply_to,
+                         correlation_id=properties.correlation_id,
+                         content_type=BINARY_CONTENT_TYPE
+                            if properties.content_type == BINARY_CONTENT_TYPE else JSON_CONTENT_TYPE,
+                         message_id=properties.message_id,)
  
     def close(self):
         self._closing = True
\ No newline at end of file
@@ -5,6 +5,8 @@ import logging
 import traceback
 
 import gateway_server
+import supervisor
+import metrics_server
 from inbox_service import InboxService
 from protocols import mqtt as protocol
 
@@ -18,13 +20,47 @@ LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name)s %(funcName)s %(lineno)d: %
 logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 
 MY_HOSTNAME = os.getenv('HOST', 'localhost')
+# Packets per client processed by the router at the same time, 1 disables pipelining
+PIPELINE_WINDOW = int(os.getenv('PIPELINE_WINDOW', 1))
+# Router responses handled per loop iteration
+INBOX_BATCH = int(os.getenv('INBOX_BATCH', 256))
+# Gateway processes sharing the ports, 1 runs the gateway without a supervisor
+WORKERS = int(os.getenv('WORKERS', 1))
+# Pending connections queued by the kernel for each listener
+LISTEN_BACKLOG = int(os.getenv('LISTEN_BACKLOG', 1024))
+# CONNECTs admitted per second and burst by each worker, 0 admits all
+CONNECT_RATE = float(os.getenv('CONNECT_RATE', 0))
+CONNECT_BURST = int(os.getenv('CONNECT_BURST', 0))
+# Port of the HTTP metrics endpoint, 0 disables it
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9887))
 
-inbox = InboxService()
-api_gateway = gateway_server.GatewayServer(MY_HOSTNAME, protocol, inbox)
-try:
-    inbox.start()
-    api_gateway.start()
-except Exception as e:
-    LOGGER.error(traceback.format_exc())
-    api_gateway.close()
-    inbox.close()
+def start_metrics(collect):
+    if not METRICS_PORT: return None
+    server = metrics_server.MetricsServer(MY_HOSTNAME, METRICS_PORT, collect)
+    server.start()
+    return server
+
+def run_gateway(index=0, stats=None):
+    # Each worker has its own exclusive inbox queue
+    inbox = InboxService()
+    api_gateway = gateway_server.GatewayServer(MY_HOSTNAME, protocol, inbox, 
+        PIPELINE_WINDOW, INBOX_BATCH, reuse_port=stats is not None,
+        backlog=LISTEN_BACKLOG, connect_rate=CONNECT_RATE, connect_burst=CONNECT_BURST)
+    if stats is not None:
+        supervisor.start_reporter(api_gateway.metrics, index, stats)
+    else:
+        start_metrics(api_gateway.metrics.snapshot)
+    try:
+        inbox.start()
+        api_gateway.start()
+    except Exception as e:
+        LOGGER.error(traceback.format_exc())
+        api_gateway.close()
+        inbox.close()
+
+if WORKERS > 1:
+    gateway_supervisor = supervisor.Supervisor(WORKERS, run_gateway)
+    start_metrics(gateway_supervisor.aggregate)
+    gateway_supervisor.start()
+else:
+    run_gateway()
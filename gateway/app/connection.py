@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import ssl
+import collections
+
+# Most buffers passed to a single scatter send
+MAX_BUFFERS = 64
+# Bounds of the adaptive read size
+MIN_READ_SIZE = 4096
+MAX_READ_SIZE = 262144
+
+class Connection:
+    __slots__ = ('socket', 'fileno', 'tls', 'pending', 'inbound', 'read_size', 'output',
+                 'output_offset', 'in_flight', 'framed', 'replies', 'window', 'max_window',
+                 'paused', 'closing', 'authenticated', 'keep_alive', 'last_activity')
+
+    def __init__(self, socket, window=1):
+        self.socket = socket
+        self.fileno = socket.fileno()
+        self.tls = isinstance(socket, ssl.SSLSocket)
+        # Bytes received but not yet framed
+        self.pending = bytearray()
+        # Packets decoded but held back by the in-flight window, with parse errors
+        self.inbound = collections.deque()
+        self.read_size = MIN_READ_SIZE
+        # Outgoing packets queued for a single scatter send, first one partially sent
+        self.output = collections.deque()
+        self.output_offset = 0
+        # Packets sent to the router and not yet answered
+        self.in_flight = 0
+        # Type and frame time of packets sent to the router, in order
+        self.framed = collections.deque()
+        # Type and frame time of packets whose reply is queued for writing
+        self.replies = []
+        # In-flight window, one packet at a time until the router accepts the client
+        self.window = 1
+        self.max_window = window
+        self.paused = False
+        self.closing = False
+        # Router accepted CONNECT, keep alive packets are answered locally
+        self.authenticated = False
+        # Keep alive in seconds requested by the client, 0 disables it
+        self.keep_alive = None
+        self.last_activity = 0
+
+    def reading(self):
+        return (not self.closing
+                and not self.paused
+                and self.in_flight < self.window)
+
+    # Grow read size while reads fill it, shrink it when they stay small
+    def adapt_read_size(self, received):
+        if received >= self.read_size:
+            self.read_size = min(self.read_size * 2, MAX_READ_SIZE)
+        elif received < self.read_size // 4:
+            self.read_size = max(self.read_size // 2, MIN_READ_SIZE)
+
+    def writing(self):
+        return bool(self.output)
+
+    def write(self, data):
+        if data: self.output.append(data)
+
+    # Queued output up to about size bytes, as a list of buffers
+    def peek_output(self, size):
+        buffers, total = [], 0
+        for data in self.output:
+            view = memoryview(data)
+            if not buffers and self.output_offset:
+                view = view[self.output_offset:]
+            buffers.append(view)
+            total += len(view)
+            if total >= size or len(buffers) >= MAX_BUFFERS: break
+        return buffers
+
+    def consume_output(self, sent):
+        sent += self.output_offset
+        while self.output and sent >= len(self.output[0]):
+            sent -= len(self.output.popleft())
+        self.output_offset = sent
+
+    # Seconds without packets from client before it is disconnected, a
+    # paused client is not read and waits at most pause_timeout instead
+    def timeout(self, connect_timeout, pause_timeout=None):
+        if self.paused:
+            return pause_timeout
+        if self.keep_alive is None:
+            return connect_timeout
+        if self.keep_alive == 0:
+            return None
+        return self.keep_alive * 1.5
+
+    def request_sent(self):
+        self.in_flight += 1
+
+    # Router accepted the client, only an answer to a request frees a window slot
+    def acknowledge(self, answer=True):
+        if answer and self.in_flight > 0:
+            self.in_flight -= 1
+        self.window = self.max_window
+        self.paused = False
+
+    def pause(self):
+        self.paused = True
@@ -1,113 +1,314 @@
 #!/usr/bin/env python3
 
+import time
+import random
 import logging
 
 import server
+import connection
+import timer_wheel
+import token_bucket
 
 LOGGER = logging.getLogger(__name__)
 
+# Time for a client to send CONNECT after opening the connection
+CONNECT_TIMEOUT_IN_SECONDS = 30
+# Time a paused client may wait for the router to resume reading it, such
+# as a user logging in with OAuth; keep alive is not enforced meanwhile
+AUTH_TIMEOUT_IN_SECONDS = 300
+# Back-off suggested to clients refused while busy, randomized up to twice as long
+CONNECT_BACKOFF_IN_SECONDS = 5
+
 class GatewayServer(server.Server):
-    def __init__(self, host, protocol, mailer):
+    def __init__(self, host, protocol, mailer, window=1, batch_limit=256, reuse_port=False,
+                 backlog=server.LISTEN_BACKLOG, connect_rate=0, connect_burst=None):
         self.protocol = protocol
         self.mailer = mailer
+        self.window = window
+        self.batch_limit = batch_limit
         self.connections = {}
-        server.Server.__init__(self, host, protocol.port, protocol.port_safe)
-
-    def get_empty_buffer(self):
-        return self.protocol.new_stream()
+        self.timers = timer_wheel.TimerWheel(time.monotonic())
+        # TLS sockets still in handshake, bound by the connect timeout
+        self.handshakes = set()
+        # CONNECTs admitted per second, 0 admits all
+        self.connect_bucket = None
+        if connect_rate > 0:
+            self.connect_bucket = token_bucket.TokenBucket(
+                connect_rate, connect_burst or connect_rate, time.monotonic())
+        server.Server.__init__(self, host, protocol.port, protocol.port_safe, reuse_port, backlog)
+        self.metrics.set('inbox_batch_limit', batch_limit)
+        self.mailer.set_notify(self.wakeup)
 
-    def get_data(self, buff, size):
-        return self.protocol.peek(buff, size)
+    def get_data(self, conn, size):
+        return conn.peek_output(size)
 
-    def set_position(self, buff, position):
-        self.protocol.position(buff, position)
+    def set_position(self, conn, position):
+        conn.consume_output(position)
 
-    def is_empty(self, buff):
-        return self.protocol.empty(buff)
+    def is_empty(self, conn):
+        return not conn.writing()
 
     def on_start(self):
         pass
 
+    def has_pending(self):
+        return not self.mailer.empty()
+
+    def get_timeout(self):
+        return self.timers.next_timeout(time.monotonic())
+
+    # Schedule disconnect of idle client, checked lazily when the timer expires
+    def schedule_timeout(self, conn):
+        timeout = conn.timeout(CONNECT_TIMEOUT_IN_SECONDS, AUTH_TIMEOUT_IN_SECONDS)
+        if timeout is None:
+            self.timers.cancel(conn)
+        else:
+            self.timers.schedule(conn, conn.last_activity + timeout)
+
+    # Disconnect clients idle longer than their keep alive allows
+    def check_timeouts(self):
+        now = time.monotonic()
+        for conn in self.timers.advance(now):
+            if conn in self.handshakes:
+                LOGGER.info('Client %s - TLS handshake timed out, closing', conn.fileno())
+                self.metrics.inc('handshake_timeouts')
+                self.reject(conn)
+                continue
+            if self.connections.get(conn.fileno) is not conn or conn.closing: continue
+            timeout = conn.timeout(CONNECT_TIMEOUT_IN_SECONDS, AUTH_TIMEOUT_IN_SECONDS)
+            if timeout is None: continue
+            if now - conn.last_activity < timeout:
+                self.schedule_timeout(conn)
+                continue
+            LOGGER.info('Client %s - %s expired, disconnecting', conn.fileno,
+                        'authentication' if conn.paused else 'keep alive')
+            self.metrics.inc('keep_alive_disconnects')
+            self.disconnect(conn.socket)
+
+    def remove(self, file_descriptor):
+        conn = self.connections.pop(file_descriptor, None)
+        if conn:
+            self.timers.cancel(conn)
+            self.metrics.add('connections_tls' if conn.tls else 'connections_plain', -1)
+
+    # Register client socket for events depending on the connection state
+    def update(self, conn):
+        self.register_events(conn.socket, conn, conn.reading(), conn.writing())
+
+    def on_accept(self, socket):
+        self.handshakes.add(socket)
+        self.metrics.set('handshakes', len(self.handshakes))
+        self.timers.schedule(socket, time.monotonic() + CONNECT_TIMEOUT_IN_SECONDS)
+
+    def on_reject(self, socket):
+        self.handshakes.discard(socket)
+        self.metrics.set('handshakes', len(self.handshakes))
+        self.timers.cancel(socket)
+
     def on_connect(self, socket):
-        self.connections[socket.fileno()] = socket
+        # Handshake done, the connection timer takes over
+        self.handshakes.discard(socket)
+        self.metrics.set('handshakes', len(self.handshakes))
+        self.timers.cancel(socket)
+        conn = connection.Connection(socket, self.window)
+        self.connections[conn.fileno] = conn
+        self.metrics.add('connections_tls' if conn.tls else 'connections_plain', 1)
+        conn.last_activity = time.monotonic()
+        self.schedule_timeout(conn)
+        self.update(conn)
 
     def on_disconnect(self, socket):
         file_descriptor = socket.fileno()
         self.mailer.publish_disconnect(file_descriptor)
-        if file_descriptor in self.connections:
-            del self.connections[file_descriptor]
+        self.remove(file_descriptor)
 
-    def on_read(self, socket, data, buff):
-        disconnect = False
-        file_descriptor = socket.fileno()
-        while data:
-            self.protocol.append(buff, data)
-            data = self.protocol.load_packet(buff)
+    def get_read_size(self, conn):
+        return conn.read_size
 
-            if self.protocol.still_loading(buff): return
-            LOGGER.info('Client %s - packet loaded', file_descriptor)
+    def on_read(self, socket, data, conn):
+        conn.adapt_read_size(len(data))
+        conn.last_activity = time.monotonic()
+        self.decode(conn, data)
+        self.process_input(conn)
+        self.update(conn)
 
-            packet, error = self.protocol.parse(buff)
+    # Decode all complete packets received, keep the incomplete rest for the
+    # next read; the receive buffer is decoded in place unless bytes are pending
+    def decode(self, conn, data):
+        if conn.pending:
+            conn.pending += data
+            data = conn.pending
+        packets, remainder = self.protocol.decode_all(data)
+        conn.inbound.extend(packets)
+        if data is conn.pending:
+            consumed = len(data) - len(remainder)
+            remainder.release()
+            if consumed: del conn.pending[:consumed]
+        else:
+            conn.pending += remainder
+            remainder.release()
+
+    # Publish decoded packets while the in-flight window allows it
+    def process_input(self, conn):
+        now = time.monotonic()
+        while conn.reading() and conn.inbound:
+            packet, error = conn.inbound.popleft()
             if error:
-                LOGGER.info('Client %s - packet error, disconnecting', file_descriptor)
-                disconnect = True
-                buff = self.protocol.compose(packet)
+                LOGGER.info('Client %s - packet error, disconnecting', conn.fileno)
+                self.metrics.inc('packets_in_invalid')
+                self.reject_packet(conn, packet)
+                break
+            self.metrics.inc('packets_in_' + packet['type'])
+
+            # Answer keep alive of authenticated clients without the router
+            if conn.authenticated:
+                response = self.protocol.local_response(packet)
+                if response is not None:
+                    self.metrics.inc('local_responses')
+                    conn.write(response)
+                    conn.replies.append((packet['type'], now))
+                    continue
+
+            # Refuse new clients over the CONNECT rate before they reach the router
+            if self.protocol.is_connect(packet) and not self.admit(now):
+                LOGGER.info('Client %s - server busy, refusing connect', conn.fileno)
+                self.metrics.inc('connects_refused')
+                retry_after = random.uniform(1, 2) * CONNECT_BACKOFF_IN_SECONDS
+                # Closed locally, the router never saw the client
+                self.reject_packet(conn, self.protocol.server_busy(retry_after), notify=False)
                 break
 
-            self.mailer.publish_request(packet, file_descriptor)
+            keep_alive = self.protocol.keep_alive(packet)
+            if keep_alive is not None:
+                conn.keep_alive = keep_alive
+                self.schedule_timeout(conn)
+
+            self.mailer.publish_request(self.protocol.request(packet), conn.fileno)
+            conn.request_sent()
+            conn.framed.append((packet['type'], now))
+
+    def admit(self, now):
+        return self.connect_bucket is None or self.connect_bucket.take(now)
 
-        if disconnect:
-            self.on_disconnect(socket)
-            self.register_write(socket, buff)
+    # Answer invalid packet with an error and close after writing it, the
+    # router is told only about clients it may have seen
+    def reject_packet(self, conn, packet, notify=True):
+        if notify:
+            self.on_disconnect(conn.socket)
         else:
-            self.unregister(socket)
+            self.remove(conn.fileno)
+        conn.closing = True
+        self.send_packet(conn, packet)
+
+    def send_packet(self, conn, packet, shared=None):
+        self.metrics.inc('packets_out_' + packet['type'])
+        for data in self.protocol.encode(packet, shared):
+            conn.write(data)
+
+    # Time from framing a packet to writing its reply, or to its answer
+    # from the router if there is no reply
+    def observe_latency(self, replies, now):
+        for packet_type, framed in replies:
+            self.metrics.observe('latency_' + packet_type, now - framed)
 
     def on_write(self, socket):
-        if socket.fileno() in self.connections:
-            buff = self.protocol.new_stream()
-            self.register_read(socket, buff)
-        else:
+        conn = self.get_key(socket).data
+        if conn.replies:
+            self.observe_latency(conn.replies, time.monotonic())
+            conn.replies = []
+        if conn.closing:
             self.unregister(socket)
             self.safe_close(socket)
+        else:
+            self.update(conn)
 
-    # Process response from Router                       // gateway_server.py
+    # Process responses from Router                       // gateway_server.py
     def in_loop_action(self):
-        # Get packet from mailer service
-        packet, fd, state = self.mailer.get()
-        if not (packet or fd or state): return
+        self.check_timeouts()
+
+        # Get pending packets from mailer service
+        batch = self.mailer.get_batch(self.batch_limit)
+        self.metrics.set('inbox_depth', self.mailer.size())
+        if not batch: return
+        self.metrics.inc('inbox_batches')
+        self.metrics.inc('inbox_messages', len(batch))
+        self.metrics.set('inbox_last_batch', len(batch))
+        if len(batch) == self.batch_limit: self.metrics.inc('inbox_batches_full')
+
+        # Queue all packets first, register each client socket once,
+        # copies of a message sent to many clients are encoded once
+        clients = {}
+        shared = {}
+        for packet, fd, state in batch:
+            conn = self.process_response(packet, fd, state, shared)
+            if conn: clients[fd] = conn
+
+        for conn in clients.values():
+            # Disconnect client socket
+            if conn.closing and not conn.writing():
+                self.unregister(conn.socket)
+                self.safe_close(conn.socket)
+            else:
+                self.update(conn)
+
+    def process_response(self, packet, fd, state, shared=None):
+        answer = packet.pop('answer', False) if packet else False
 
         # Delete file descriptor if client socket not valid or disconnected 
-        client_socket = self.connections.get(fd)
+        conn = self.connections.get(fd)
         socket_invalid = False
         try:
-            client_socket.getpeername()
+            conn.socket.getpeername()
         except (OSError, AttributeError):
             socket_invalid = True
         if socket_invalid or state == 'disconnect': 
             self.mailer.publish_disconnect(fd)
-            if fd in self.connections: del self.connections[fd]
-            if socket_invalid: return
+            self.remove(fd)
+            if socket_invalid: return None
 
-        # Send package to client, after writing disconnect, listen or ignore
+        # Queue package for client ahead of responses to packets read below,
+        # flushed together with other queued packages
+        if answer and conn.framed:
+            if packet:
+                conn.replies.append(conn.framed.popleft())
+            else:
+                self.observe_latency([conn.framed.popleft()], time.monotonic())
         if packet:
-            package_buffer = self.protocol.compose(packet)
-            self.register_write(client_socket, package_buffer)
-        # Disconnect client socket
-        elif state == 'disconnect':
-            self.unregister(client_socket)
-            self.safe_close(client_socket)
-        # Listen on client socket
+            if self.protocol.accepted(packet): conn.authenticated = True
+            self.send_packet(conn, packet, shared)
+
+        # Disconnect after writing, resume reading or pause the client
+        if state == 'disconnect':
+            conn.closing = True
         elif state == 'read':
-            package_buffer = self.protocol.new_stream()
-            self.register_read(client_socket, package_buffer)
-        # Ignore client
-        else: self.unregister(client_socket)
+            # Idle time of a paused client starts when reading resumes
+            paused = conn.paused
+            if not conn.reading(): conn.last_activity = time.monotonic()
+            conn.acknowledge(answer)
+            if paused: self.schedule_timeout(conn)
+            self.process_input(conn)
+        elif state == 'idle':
+            # Pause is bound by its own timeout, client packets are not read
+            conn.pause()
+            conn.last_activity = time.monotonic()
+            self.schedule_timeout(conn)
+        return conn
 
-    def on_close(self, packet):
+    def on_close(self):
         if len(self.connections) > 0:
-            for client in self.connections.values():
-                self.unregister(client)
+            for conn in self.connections.values():
+                if self.get_key(conn.socket) is not None:
+                    self.unregister(conn.socket)
             self.connections = {}
+            self.metrics.set('connections_tls', 0)
+            self.metrics.set('connections_plain', 0)
+        for socket in self.handshakes:
+            if self.get_key(socket) is not None:
+                self.unregister(socket)
+            self.safe_close(socket)
+        self.handshakes = set()
+        self.metrics.set('handshakes', 0)
+        self.timers = timer_wheel.TimerWheel(time.monotonic())
 
     # def get_socket(self, addr):
     #     return self.connections.get(addr)
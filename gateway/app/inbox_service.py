@@ -19,6 +19,7 @@ class InboxService(abstract_service.AbstractService):
     def __init__(self, dummy_messenger=None):
         self.inbox = queue.Queue()
         self.dummy_messenger = dummy_messenger
+        self.notify = None
         abstract_service.AbstractService.__init__(self)
         self.actions = {'receive_package': self.receive_package}
         
@@ -26,11 +27,28 @@ class InboxService(abstract_service.AbstractService):
         state = request['state']
         del request['state']
         self.inbox.put((request, int(props.correlation_id), state))
-
-    def get(self):
-        if self.inbox.empty():
-            return None, None, None
-        return self.inbox.get()
+        if self.notify: self.notify()
+
+    # Callback executed on every received package, wakes up the gateway loop
+    def set_notify(self, notify):
+        self.notify = notify
+
+    def empty(self):
+        return self.inbox.empty()
+
+    # Received packages not yet taken by the gateway loop
+    def size(self):
+        return self.inbox.qsize()
+
+    # Get up to limit received packages without blocking
+    def get_batch(self, limit):
+        batch = []
+        try:
+            while len(batch) < limit:
+                batch.append(self.inbox.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
 
     def publish_request(self, packet, file_descriptor):
         packet['command'] = 'process'
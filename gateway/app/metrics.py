@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import bisect
+import time
+
+# Upper bounds in seconds of latency histogram buckets, last bucket is unbounded
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Counters, gauges, rates and histograms updated by the gateway loop thread only,
+# snapshot may be taken from any thread
+class Metrics:
+    def __init__(self):
+        # Counters only grow, gauges hold the latest value
+        self.counters = {}
+        self.gauges = {}
+        # Rate name -> [second, events in that second, events in the second before]
+        self.rates = {}
+        # Histogram name -> [bucket counts, sum]
+        self.histograms = {}
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    # Change gauge by value
+    def add(self, name, value):
+        self.gauges[name] = self.gauges.get(name, 0) + value
+
+    # Count event of a per second rate
+    def mark(self, name, now=None):
+        second = int(time.monotonic() if now is None else now)
+        rate = self.rates.get(name)
+        if rate is None:
+            self.rates[name] = [second, 1, 0]
+        elif rate[0] == second:
+            rate[1] += 1
+        else:
+            rate[2] = rate[1] if rate[0] == second - 1 else 0
+            rate[0], rate[1] = second, 1
+
+    # Events in the last complete second
+    def rate(self, name, now=None):
+        second = int(time.monotonic() if now is None else now)
+        last, count, previous = self.rates.get(name, (second, 0, 0))
+        if last == second: return previous
+        if last == second - 1: return count
+        return 0
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [[0] * (len(LATENCY_BUCKETS) + 1), 0]
+        histogram[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[1] += value
+
+    def snapshot(self):
+        gauges = dict(self.gauges)
+        for name in list(self.rates):
+            gauges[name] = self.rate(name)
+        return {'counters': dict(self.counters),
+                'gauges': gauges,
+                'histograms': {name: {'buckets': list(LATENCY_BUCKETS),
+                                      'counts': list(counts),
+                                      'sum': total}
+                               for name, (counts, total) in list(self.histograms.items())}}
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOGGER = logging.getLogger(__name__)
+
+# Serve metrics as JSON on GET /metrics, collect returns the metrics to serve
+class MetricsServer:
+    def __init__(self, host, port, collect):
+        self.host = host
+        self.port = port
+        self.collect = collect
+        self.httpd = None
+        self.thread = None
+
+    def handler(self):
+        collect = self.collect
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = json.dumps(collect()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOGGER.debug(format, *args)
+
+        return Handler
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        LOGGER.info('Metrics served on %s:%s', self.host, self.port)
+
+    def close(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -1,6 +1,11 @@
+import math
+
 from . import parser
 from .stream import Stream
 from . import const
+from . import datatypes
+from . import encoder
+from . import packets
 
 port = 1887
 port_safe = 8887
@@ -9,28 +14,152 @@ def new_stream():
     return Stream()
 
 def parse(stream):
-    packet = parser.read(stream)
-    error = packet.get('error')
-    if not error:
-        if packet['type'] in [const.CONNACK,
-                              const.SUBACK,
-                              const.UNSUBACK,
-                              const.PINGRESP,]:
-            error = const.PROTOCOL_ERROR
-    if error:
-        new_packet = {'code': error}
-        if packet['type'] == const.CONNECT:
-            new_packet['type'] = const.CONNACK
-        else:
-            new_packet['type'] = const.DISCONNECT
-        return new_packet, True
-    return packet, False
+    return check(parser.read(stream))
+
+# Parse frame returned by read_frame
+def parse_frame(frame):
+    return check(parser.read_frame(frame))
+
+# Type codes of packets only servers send
+SERVER_ONLY = {packets.Connack.type_code,
+               packets.Suback.type_code,
+               packets.Unsuback.type_code,
+               packets.Pingresp.type_code,}
+
+# Packet to send back and True if packet is an error or not allowed from
+# clients, parse errors are dictionaries with the error
+def check(packet):
+    if isinstance(packet, dict):
+        error = packet['error']
+    elif packet.type_code in SERVER_ONLY:
+        error = const.PROTOCOL_ERROR
+    else:
+        return packet, False
+    new_packet = {'code': error}
+    if packet['type'] == const.CONNECT:
+        new_packet['type'] = const.CONNACK
+    else:
+        new_packet['type'] = const.DISCONNECT
+    return new_packet, True
+
+# Largest packet accepted from a client, fixed header included
+MAX_PACKET_SIZE = 1 << 21
+
+# Results of frame_size other than a size
+FRAME_INCOMPLETE = -1
+FRAME_MALFORMED = -2
+FRAME_TOO_LARGE = -3
+
+# Remaining length and fixed header size of packet at offset, or a FRAME_ error
+def fixed_header(data, offset=0, max_size=MAX_PACKET_SIZE):
+    size = 0
+    for index in range(1, 5):
+        if offset + index >= len(data):
+            return FRAME_INCOMPLETE, 0
+        byte = data[offset + index]
+        size |= (byte & 0x7F) << (7 * (index - 1))
+        if byte & 0x80 == 0:
+            if size + 1 + index > max_size:
+                return FRAME_TOO_LARGE, 0
+            return size, 1 + index
+    # Remaining length is at most four bytes
+    return FRAME_MALFORMED, 0
+
+# Size of the first packet in data including fixed header, or a FRAME_ error
+def frame_size(data, max_size=MAX_PACKET_SIZE):
+    size, header = fixed_header(data, 0, max_size)
+    return size + header if size >= 0 else size
+
+# Frame of the packet at offset of a memoryview and its size, frame is
+# (first byte, remaining length, body), body is a view into data; frame is
+# None and size a FRAME_ error if there is no complete packet
+def read_frame(data, offset=0, max_size=MAX_PACKET_SIZE):
+    size, header = fixed_header(data, offset, max_size)
+    if size < 0:
+        return None, size
+    end = offset + header + size
+    if end > len(data):
+        return None, FRAME_INCOMPLETE
+    return (data[offset], size, data[offset + header:end]), header + size
+
+# DISCONNECT sent to a client whose packet could not be framed
+def frame_error(size):
+    if size == FRAME_TOO_LARGE:
+        return {'type': const.DISCONNECT, 'code': const.PACKET_TOO_LARGE}
+    return {'type': const.DISCONNECT, 'code': const.MALFORMED_PACKET}
+
+def is_connect(packet):
+    return packet.type_code == packets.Connect.type_code
+
+# CONNACK refusing a client while the server is overloaded, with a back-off hint
+def server_busy(retry_after):
+    seconds = str(int(math.ceil(retry_after)))
+    return {'type': const.CONNACK,
+            'code': const.SERVER_BUSY,
+            'session_present': False,
+            'properties': {'reason_string': 'Server busy, retry after %s seconds' % seconds,
+                           'user_property': [('retry-after', seconds)]}}
+
+# Parse every complete packet of buffer in one pass, returns a list of
+# (packet, error) pairs as returned by parse and a memoryview of the bytes
+# left over, the view has to be released before buffer is resized; a packet
+# with a malformed length ends the list with its error and the rest is dropped
+def decode_all(buffer, max_size=MAX_PACKET_SIZE):
+    view = memoryview(buffer)
+    packets = []
+    offset = 0
+    while True:
+        frame, size = read_frame(view, offset, max_size)
+        if size == FRAME_INCOMPLETE:
+            break
+        if frame is None:
+            packets.append((frame_error(size), True))
+            offset = len(view)
+            break
+        packets.append(parse_frame(frame))
+        offset += size
+    frame = None
+    remainder = view[offset:]
+    view.release()
+    return packets, remainder
+
+# Packet dictionary sent to the router
+def request(packet):
+    if isinstance(packet, dict):
+        return packet
+    return packet.to_dict()
+
+# Keep alive requested by client, None if packet is not CONNECT
+def keep_alive(packet):
+    if packet.type_code != packets.Connect.type_code:
+        return None
+    return packet.keep_alive
 
 def compose(packet):
     stream = Stream()
     parser.write(packet, stream)
     return stream
 
+# Packet as a list of buffers, copies of a PUBLISH encoded with the same
+# shared dictionary reuse one buffer for their properties and payload
+def encode(packet, shared=None):
+    if shared is None or packet['type'] != const.PUBLISH:
+        return [encoder.encode(packet)]
+    return encoder.encode_shared(packet, shared)
+
+# Keep alive response sent by the gateway itself, same bytes for every client
+PINGRESP = compose({'type': const.PINGRESP}).dump()
+
+# Router accepted the client, its packets are authenticated from now on
+def accepted(packet):
+    return packet['type'] == const.CONNACK and packet.get('code', 0) == 0
+
+# Response answered without the router, None if the router has to handle packet
+def local_response(packet):
+    if packet.type_code == packets.Pingreq.type_code:
+        return PINGRESP
+    return None
+
 def append(stream, data):
     stream.append(data)
 
@@ -46,6 +175,9 @@ def write(stream, data):
 def peek(stream, size):
     return stream.output(size)
 
+def dump(stream):
+    return stream.dump()
+
 def position(stream, position):
     stream.update(position)
 
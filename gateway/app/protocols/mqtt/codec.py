@@ -0,0 +1,157 @@
+import struct
+
+from . import const
+
+# Property codec tables compiled from const.DICT once at import time
+
+BYTE = struct.Struct(">B")
+TWO_BYTE_INT = struct.Struct(">H")
+FOUR_BYTE_INT = struct.Struct(">L")
+
+#==========================++++++++++++++++++==========================
+#                          +++++        +++++
+#                          +++++ DECODE +++++
+#                          +++++        +++++
+#==========================++++++++++++++++++==========================
+
+# Decoders take buffer and position and return value and position after it,
+# they raise IndexError, struct.error or UnicodeDecodeError on bad input
+
+def decode_byte(buffer, position):
+    return buffer[position], position + 1
+
+def decode_two_byte_int(buffer, position):
+    return TWO_BYTE_INT.unpack_from(buffer, position)[0], position + 2
+
+def decode_four_byte_int(buffer, position):
+    return FOUR_BYTE_INT.unpack_from(buffer, position)[0], position + 4
+
+def decode_variable_byte_int(buffer, position):
+    value = buffer[position]
+    if value < 0x80:
+        return value, position + 1
+    value = 0
+    for shift in (0, 7, 14, 21):
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80 == 0:
+            return value, position
+    raise IndexError('Malformed Variable Byte Integer')
+
+def decode_binary_data(buffer, position):
+    length = TWO_BYTE_INT.unpack_from(buffer, position)[0]
+    end = position + 2 + length
+    if end > len(buffer):
+        raise IndexError('Binary data out of bounds')
+    return bytes(buffer[position + 2:end]), end
+
+def decode_utf8_encoded_string(buffer, position):
+    end = position + 2 + (buffer[position] << 8 | buffer[position + 1])
+    if end > len(buffer):
+        raise IndexError('String out of bounds')
+    return str(buffer[position + 2:end], 'utf-8'), end
+
+def decode_utf8_string_pair(buffer, position):
+    end = position + 2 + (buffer[position] << 8 | buffer[position + 1])
+    if end + 2 > len(buffer):
+        raise IndexError('String out of bounds')
+    key = str(buffer[position + 2:end], 'utf-8')
+    position = end + 2 + (buffer[end] << 8 | buffer[end + 1])
+    if position > len(buffer):
+        raise IndexError('String out of bounds')
+    return (key, str(buffer[end + 2:position], 'utf-8')), position
+
+#==========================++++++++++++++++++==========================
+#                          +++++        +++++
+#                          +++++ ENCODE +++++
+#                          +++++        +++++
+#==========================++++++++++++++++++==========================
+
+def encode_byte(value):
+    return BYTE.pack(value)
+
+def encode_two_byte_int(value):
+    return TWO_BYTE_INT.pack(value)
+
+def encode_four_byte_int(value):
+    return FOUR_BYTE_INT.pack(value)
+
+def encode_variable_byte_int(value):
+    if value < 0x80:
+        return BYTE.pack(value)
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+def encode_binary_data(value):
+    return TWO_BYTE_INT.pack(len(value)) + value
+
+def encode_utf8_encoded_string(value):
+    return encode_binary_data(value.encode('utf-8'))
+
+def encode_utf8_string_pair(value):
+    return encode_utf8_encoded_string(value[0]) + encode_utf8_encoded_string(value[1])
+
+#==========================++++++++++++++++++==========================
+#                          +++++        +++++
+#                          +++++ TABLES +++++
+#                          +++++        +++++
+#==========================++++++++++++++++++==========================
+
+TYPE_DECODERS = {
+    const.BYTE: decode_byte,
+    const.TWO_BYTE_INT: decode_two_byte_int,
+    const.FOUR_BYTE_INT: decode_four_byte_int,
+    const.VARIABLE_BYTE_INT: decode_variable_byte_int,
+    const.BINARY_DATA: decode_binary_data,
+    const.UTF8_ENCODED_STRING: decode_utf8_encoded_string,
+    const.UTF8_STRING_PAIR: decode_utf8_string_pair,
+}
+
+TYPE_ENCODERS = {
+    const.BYTE: encode_byte,
+    const.TWO_BYTE_INT: encode_two_byte_int,
+    const.FOUR_BYTE_INT: encode_four_byte_int,
+    const.VARIABLE_BYTE_INT: encode_variable_byte_int,
+    const.BINARY_DATA: encode_binary_data,
+    const.UTF8_ENCODED_STRING: encode_utf8_encoded_string,
+    const.UTF8_STRING_PAIR: encode_utf8_string_pair,
+}
+
+# Property code <-> name
+NAMES = {code: features['name'] for code, features in const.DICT.items()}
+CODES = {name: code for code, name in NAMES.items()}
+
+# Property code -> decoder, encoder and the encoded property identifier
+DECODERS = {code: TYPE_DECODERS[features['type']] for code, features in const.DICT.items()}
+ENCODERS = {code: TYPE_ENCODERS[features['type']] for code, features in const.DICT.items()}
+IDENTIFIERS = {code: encode_variable_byte_int(code) for code in const.DICT}
+
+# Property bitmasks, bit 1 << code is set for each property code
+def mask(codes):
+    bits = 0
+    for code in codes:
+        bits |= 1 << code
+    return bits
+
+BOOL = mask(code for code, features in const.DICT.items() if features['bool'])
+NONZERO = mask(code for code, features in const.DICT.items() if features['nonzero'])
+
+PACKET_TYPES = list(const.TYPE_TRANSLATOR) + [const.WILL]
+
+# Packet type -> properties allowed in it
+ALLOWED = {packet_type: mask(code for code, features in const.DICT.items()
+                             if packet_type in features['group'])
+           for packet_type in PACKET_TYPES}
+
+# Packet type -> properties that may repeat and are kept as lists
+LISTS = {packet_type: mask([const.USER_PROPERTY]) for packet_type in PACKET_TYPES}
+LISTS[const.PUBLISH] |= mask([const.SUBSCRIPTION_IDENTIFIER])
+DEFAULT_LISTS = mask([const.USER_PROPERTY])
@@ -43,10 +43,10 @@ TYPE_TRANSLATOR = {
     AUTH: 0xF0,
 }
 
+TYPE_NAMES = {code: name for name, code in TYPE_TRANSLATOR.items()}
+
 def get_type_str(value):
-    return list(TYPE_TRANSLATOR.keys())[
-            list(TYPE_TRANSLATOR.values()).index(value)
-        ]
+    return TYPE_NAMES[value]
 
 def get_type_code(value):
     return TYPE_TRANSLATOR.get(value)
@@ -55,6 +55,8 @@ UNSPECIFIED_ERROR = 0x80
 MALFORMED_PACKET = 0X81
 PROTOCOL_ERROR = 0X82
 UNSUPPORTED_PROTOCOL_VERSION = 0x84
+PACKET_TOO_LARGE = 0x95
+SERVER_BUSY = 0x89
 PAYLOAD_FORMAT_INVALID = 0x99
 
 SERVER_REFERENCE = 0X1C # Unique
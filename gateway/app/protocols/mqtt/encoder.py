@@ -0,0 +1,139 @@
+from .const import *
+from . import codec
+
+# Single pass encoder for packets composed by the server itself, values are
+# trusted and not type checked; parts of a packet are collected first so the
+# remaining length is known, then copied once into a buffer of the final size
+
+def encode(packet):
+    packet_type = packet['type']
+    parts = []
+    first_byte = TYPE_TRANSLATOR[packet_type]
+
+    if packet_type == PUBLISH:
+        qos = packet.get('qos', 0)
+        first_byte |= qos << 1
+        if packet.get('dup', False): first_byte |= 0x08
+        if packet.get('retain', False): first_byte |= 0x01
+        parts.append(codec.encode_utf8_encoded_string(packet['topic']))
+        if qos > 0:
+            parts.append(codec.encode_two_byte_int(packet['id']))
+        put_properties(parts, packet.get('properties', {}), PUBLISH)
+        parts.append(packet.get('payload', b""))
+    elif packet_type in [SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK]:
+        put_sub_packet(parts, packet)
+    elif packet_type == CONNECT:
+        put_connect_packet(parts, packet)
+    elif packet_type not in [PINGREQ, PINGRESP]:
+        if packet_type == CONNACK:
+            parts.append(b"\x01" if packet.get('session_present', False) else b"\x00")
+        if packet_type in [PUBACK, PUBREC, PUBREL, PUBCOMP]:
+            parts.append(codec.encode_two_byte_int(packet['id']))
+        parts.append(codec.encode_byte(packet['code']))
+        put_properties(parts, packet.get('properties', {}))
+
+    size = 0
+    for part in parts:
+        size += len(part)
+    parts.insert(0, encode_header(first_byte, size))
+    # Join allocates the packet at its final size and copies every part once
+    return b"".join(parts)
+
+# PUBLISH as a prefix for one client and a suffix shared by all copies of the
+# message in shared, the suffix holds the payload and all properties except
+# subscription identifiers, which differ between subscribers like the packet id
+def encode_shared(packet, shared):
+    properties = packet.get('properties', {})
+    identifiers = properties.get('subscription_identifier', [])
+    if identifiers:
+        properties = {key: value for key, value in properties.items()
+                      if key != 'subscription_identifier'}
+    payload = packet.get('payload', b"")
+    key = (packet['topic'], payload, repr(properties))
+    parts = shared.get(key)
+    if parts is None:
+        suffix = []
+        put_properties(suffix, properties, PUBLISH)
+        # Length of the shared properties, without its encoding
+        length = len(b"".join(suffix)) - len(suffix[0])
+        suffix[0] = payload
+        suffix.append(suffix.pop(0))
+        parts = shared[key] = (codec.encode_utf8_encoded_string(packet['topic']),
+                               length,
+                               memoryview(b"".join(suffix)))
+    topic, length, suffix = parts
+
+    qos = packet.get('qos', 0)
+    prefix = [topic]
+    if qos > 0:
+        prefix.append(codec.encode_two_byte_int(packet['id']))
+    ids = b"".join(codec.IDENTIFIERS[SUBSCRIPTION_IDENTIFIER]
+                   + codec.encode_variable_byte_int(value) for value in identifiers)
+    prefix.append(codec.encode_variable_byte_int(length + len(ids)))
+    prefix.append(ids)
+    prefix = b"".join(prefix)
+
+    first_byte = TYPE_TRANSLATOR[PUBLISH] | qos << 1
+    if packet.get('dup', False): first_byte |= 0x08
+    if packet.get('retain', False): first_byte |= 0x01
+    return [encode_header(first_byte, len(prefix) + len(suffix)) + prefix, suffix]
+
+def encode_header(first_byte, remaining_length):
+    return codec.encode_byte(first_byte) + codec.encode_variable_byte_int(remaining_length)
+
+def put_sub_packet(parts, packet):
+    packet_type = packet['type']
+    parts.append(codec.encode_two_byte_int(packet['id']))
+    put_properties(parts, packet.get('properties', {}))
+    for topic in packet['topics']:
+        if packet_type in [SUBSCRIBE, UNSUBSCRIBE]:
+            parts.append(codec.encode_utf8_encoded_string(topic['filter']))
+        if packet_type == SUBSCRIBE:
+            flags = topic.get('max_qos', 2) | topic.get('retain_handling', 0) << 4
+            if topic.get('no_local', False): flags |= 0x04
+            if topic.get('retain_as_published', False): flags |= 0x08
+            parts.append(codec.encode_byte(flags))
+        if packet_type in [SUBACK, UNSUBACK]:
+            parts.append(codec.encode_byte(topic['code']))
+
+def put_connect_packet(parts, packet):
+    parts.append(b"\x00\x04MQTT\x05")
+    will = packet.get('will')
+    flags = 0
+    if 'username' in packet: flags |= 0x80
+    if 'password' in packet: flags |= 0x40
+    if will:
+        flags |= 0x04 | will['qos'] << 3
+        if will['retain']: flags |= 0x20
+    if packet.get('clean_start', False): flags |= 0x02
+    parts.append(codec.encode_byte(flags))
+    parts.append(codec.encode_two_byte_int(packet.get('keep_alive', 0)))
+    put_properties(parts, packet.get('properties', {}))
+    parts.append(codec.encode_utf8_encoded_string(packet['client_id']))
+    if will:
+        put_properties(parts, will['properties'])
+        parts.append(codec.encode_utf8_encoded_string(will['topic']))
+        parts.append(codec.encode_binary_data(will['payload']))
+    if 'username' in packet:
+        parts.append(codec.encode_utf8_encoded_string(packet['username']))
+    if 'password' in packet:
+        parts.append(codec.encode_binary_data(packet['password']))
+
+def put_properties(parts, properties, packet_type=None):
+    index = len(parts)
+    parts.append(b"")
+    size = 0
+    lists = codec.LISTS.get(packet_type, codec.DEFAULT_LISTS)
+    for key, value in properties.items():
+        code = codec.CODES.get(key)
+        if code is None:
+            continue
+        encoder = codec.ENCODERS[code]
+        identifier = codec.IDENTIFIERS[code]
+        for element in (value if lists & (1 << code) else [value]):
+            encoded = encoder(element)
+            parts.append(identifier)
+            parts.append(encoded)
+            size += len(identifier) + len(encoded)
+    # Property length goes in front of the properties
+    parts[index] = codec.encode_variable_byte_int(size)
@@ -0,0 +1,172 @@
+import types
+
+from .const import *
+
+# Packets received from clients, one class per packet type with the type
+# code of the fixed header as an integer; packets read like the packet
+# dictionary of compose, with absent optional fields missing, and fields
+# other than the packet fields can be set and are kept apart
+class Packet:
+    __slots__ = ('fields',)
+    type_code = 0
+    type = RESERVED
+    # Packet fields in the order of the packet dictionary
+    FIELDS = ('type',)
+
+    def __init__(self):
+        self.fields = None
+
+    # Optional fields are unset slots, read from the slot itself so that no
+    # property computing a field runs just to check for it
+    def has(self, key):
+        if key not in self.FIELDS:
+            return False
+        slot = getattr(type(self), key)
+        if type(slot) is not types.MemberDescriptorType:
+            return True
+        try:
+            slot.__get__(self)
+        except AttributeError:
+            return False
+        return True
+
+    def __getitem__(self, key):
+        if self.fields and key in self.fields:
+            return self.fields[key]
+        if not self.has(key):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if self.fields and key in self.fields:
+            return self.fields[key]
+        if self.has(key):
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key):
+        return bool(self.fields) and key in self.fields or self.has(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+            return
+        if self.fields is None:
+            self.fields = {}
+        self.fields[key] = value
+
+    def pop(self, key, default=None):
+        return self.fields.pop(key, default) if self.fields else default
+
+    # Packet dictionary for consumers of compose and the router
+    def to_dict(self):
+        packet = {key: getattr(self, key) for key in self.FIELDS if self.has(key)}
+        if self.fields:
+            packet.update(self.fields)
+        return packet
+
+    def __eq__(self, other):
+        if isinstance(other, Packet):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_dict())
+
+class Connect(Packet):
+    __slots__ = ('clean_start', 'keep_alive', 'properties', 'client_id', 'will', 'username', 'password')
+    type_code = 0x1
+    type = CONNECT
+    FIELDS = ('type',) + __slots__
+
+class Connack(Packet):
+    __slots__ = ('session_present', 'code', 'properties')
+    type_code = 0x2
+    type = CONNACK
+    FIELDS = ('type',) + __slots__
+
+class Publish(Packet):
+    __slots__ = ('dup', 'qos', 'retain', 'topic', 'id', 'properties', 'payload')
+    type_code = 0x3
+    type = PUBLISH
+    FIELDS = ('type',) + __slots__
+
+# PUBACK, PUBREC, PUBREL and PUBCOMP
+class Ack(Packet):
+    __slots__ = ('id', 'code', 'properties')
+    FIELDS = ('type',) + __slots__
+
+class Puback(Ack):
+    __slots__ = ()
+    type_code = 0x4
+    type = PUBACK
+
+class Pubrec(Ack):
+    __slots__ = ()
+    type_code = 0x5
+    type = PUBREC
+
+class Pubrel(Ack):
+    __slots__ = ()
+    type_code = 0x6
+    type = PUBREL
+
+class Pubcomp(Ack):
+    __slots__ = ()
+    type_code = 0x7
+    type = PUBCOMP
+
+# SUBSCRIBE, SUBACK, UNSUBSCRIBE and UNSUBACK
+class Sub(Packet):
+    __slots__ = ('id', 'properties', 'topics')
+    FIELDS = ('type',) + __slots__
+
+class Subscribe(Sub):
+    __slots__ = ()
+    type_code = 0x8
+    type = SUBSCRIBE
+
+class Suback(Sub):
+    __slots__ = ()
+    type_code = 0x9
+    type = SUBACK
+
+class Unsubscribe(Sub):
+    __slots__ = ()
+    type_code = 0xA
+    type = UNSUBSCRIBE
+
+class Unsuback(Sub):
+    __slots__ = ()
+    type_code = 0xB
+    type = UNSUBACK
+
+class Pingreq(Packet):
+    __slots__ = ()
+    type_code = 0xC
+    type = PINGREQ
+
+class Pingresp(Packet):
+    __slots__ = ()
+    type_code = 0xD
+    type = PINGRESP
+
+# DISCONNECT and AUTH
+class Reason(Packet):
+    __slots__ = ('code', 'properties')
+    FIELDS = ('type',) + __slots__
+
+class Disconnect(Reason):
+    __slots__ = ()
+    type_code = 0xE
+    type = DISCONNECT
+
+class Auth(Reason):
+    __slots__ = ()
+    type_code = 0xF
+    type = AUTH
+
+# Packet type code -> packet class
+CLASSES = {cls.type_code: cls for cls in (Connect, Connack, Publish, Puback, Pubrec, Pubrel, Pubcomp,
+                                          Subscribe, Suback, Unsubscribe, Unsuback,
+                                          Pingreq, Pingresp, Disconnect, Auth)}
@@ -1,6 +1,9 @@
+import struct
 import logging
 from .const import *
 from . import stream as stream_module
+from . import codec
+from . import packets
 
 class MalformedPacketError(Exception):
     def __init__(self, message):
@@ -21,75 +24,98 @@ class UnsupportedProtocolError(Exception):
 #==========================+++++++++++++++++==========================
 
 def read(stream):
-    packet = {}
+    return read_packet(stream)
+
+# Parse packet from frame of first byte, remaining length and body
+def read_frame(frame):
+    first_byte, remaining_length, body = frame
+    return read_packet(stream_module.Stream(body), first_byte)
+
+# Packet object of packet type code, or a dictionary with type and error
+def read_packet(stream, first_byte=None):
     try:
 
-        # Parse fixed header                                                                // parser.py
-        packet['type'], dup, qos, retain = stream.get_header()
-        if packet['type'] == RESERVED:
+        # Parse fixed header, unless framing already did                                   // parser.py
+        if first_byte is None:
+            first_byte = stream.get_byte()
+            stream.get_var_int()
+        type_code = first_byte >> 4
+        if type_code == 0:
             raise MalformedPacketError("Bad packet type")
-        elif packet['type'] == PUBLISH:
+        packet = packets.CLASSES[type_code]()
+        if type_code == packets.Publish.type_code:
+            packet_type, dup, qos, retain = stream_module.decode_header(first_byte)
             if qos not in range(3): raise MalformedPacketError("Bad QoS")
-            packet['dup'], packet['qos'], packet['retain'] = dup, qos, retain
-        elif dup or retain or qos != 0: raise MalformedPacketError("Bytes 0-3 reserved")
-        stream.get_var_int()
+            packet.dup, packet.qos, packet.retain = dup, qos, retain
+        elif first_byte & 0x0F: raise MalformedPacketError("Bytes 0-3 reserved")
 
         # Parse variable header and payload
-        # Ping packets - no variable header and no payload
-        if packet['type'] in [PINGREQ, PINGRESP]: pass
-        # Publish packet
-        if packet['type'] == PUBLISH: read_pub_packet(packet, stream)
-        # Subscription packets
-        elif packet['type'] in [SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK]: read_sub_packet(packet, stream)
-        # Connection packet
-        elif packet['type'] == CONNECT: read_connect_packet(packet, stream)
-        # Connection acknowledge, publish handshake (QoS > 0), authenticate
-        # and disconnect packets - no payload 
-        else: 
-            if packet['type'] == CONNACK:
-                packet['session_present'], reserved = stream.get_connack_flags()
-                if reserved != 0: raise MalformedPacketError("Bytes 1-7 reserved")
-            if packet['type'] in [PUBACK, PUBREC, PUBREL, PUBCOMP]: packet['id'] = stream.get_int()
-            packet['code'] = stream.get_byte()
-            packet['properties'] = get_properties(stream, packet['type'])
-
-
-        logging.info(f"Received {packet['type']} packet type")
-    except (MalformedPacketError,
-            stream_module.PropertiesError,
-            stream_module.MalformedVariableIntegerError,
-            stream_module.OutOfBoundsError) as e:
-        packet['error'] = MALFORMED_PACKET
-        logging.error(repr(e))
-    except ProtocolError as e: 
-        packet['error'] = PROTOCOL_ERROR
-        logging.error(repr(e))
-    except UnsupportedProtocolError as e:
-        packet['error'] = UNSUPPORTED_PROTOCOL_ERROR
-        logging.error(repr(e))
+        READERS[type_code](packet, stream)
+        logging.info(f"Received {packet.type} packet type")
+        return packet
     except Exception as e:
-        packet['error'] = UNSPECIFIED_ERROR
-        logging.error(repr(e))
-    return packet
+        packet_type = RESERVED if first_byte is None else get_type_str(first_byte & 0xF0)
+        return {'type': packet_type, 'error': error_code(e)}
+
+# Reason code of an error raised while parsing
+def error_code(e):
+    logging.error(repr(e))
+    if isinstance(e, (MalformedPacketError,
+                      stream_module.PropertiesError,
+                      stream_module.MalformedVariableIntegerError,
+                      stream_module.OutOfBoundsError,
+                      IndexError,
+                      UnicodeDecodeError,
+                      struct.error)):
+        return MALFORMED_PACKET
+    if isinstance(e, ProtocolError):
+        return PROTOCOL_ERROR
+    if isinstance(e, UnsupportedProtocolError):
+        return UNSUPPORTED_PROTOCOL_ERROR
+    return UNSPECIFIED_ERROR
 
 def read_pub_packet(packet, stream):
     logging.info("Parsing PUB packet")
-    packet['topic'] = stream.get_string()
-    if packet['qos'] > 0:
-        packet['id'] = stream.get_int()
-    packet['properties'] = get_properties(stream, packet['type'])
-    packet['payload'] = stream.dump()
+    packet.topic = stream.get_string()
+    if packet.qos > 0:
+        packet.id = stream.get_int()
+    packet.properties = get_properties(stream, packet.type)
+    packet.payload = stream.dump()
+
+# Ping packets - no variable header and no payload
+def read_ping_packet(packet, stream):
+    pass
+
+# Connection acknowledge, publish handshake (QoS > 0), authenticate and
+# disconnect packets - no payload
+def read_connack_packet(packet, stream):
+    packet.session_present, reserved = stream.get_connack_flags()
+    if reserved != 0: raise MalformedPacketError("Bytes 1-7 reserved")
+    read_reason_packet(packet, stream)
+
+def read_ack_packet(packet, stream):
+    packet.id = stream.get_int()
+    read_reason_packet(packet, stream)
+
+def read_reason_packet(packet, stream):
+    packet.code = stream.get_byte()
+    packet.properties = get_properties(stream, packet.type)
+
+# Type codes of subscription packets with topic filters, and with reason codes
+FILTERS = {packets.Subscribe.type_code, packets.Unsubscribe.type_code}
+REASONS = {packets.Suback.type_code, packets.Unsuback.type_code}
 
 def read_sub_packet(packet, stream):
     logging.info("Parsing SUB packet")
-    packet['id'] = stream.get_int()
-    packet['properties'] = get_properties(stream, packet['type'])
-    packet['topics'] = list()
+    type_code = packet.type_code
+    packet.id = stream.get_int()
+    packet.properties = get_properties(stream, packet.type)
+    packet.topics = list()
     while not stream.empty():
         topic = {}
-        if packet['type'] in [SUBSCRIBE, UNSUBSCRIBE]:
+        if type_code in FILTERS:
             topic['filter'] = stream.get_string()
-        if packet['type'] == SUBSCRIBE:
+        if type_code == packets.Subscribe.type_code:
             retain_handling, retain_as_published, \
                 no_local, max_qos, reserved = stream.get_sub_flags()
             if reserved != 0:
@@ -102,9 +128,9 @@ def read_sub_packet(packet, stream):
             topic['retain_handling'] = retain_handling
             topic['no_local'] = no_local
             topic['retain_as_published'] = retain_as_published
-        if packet['type'] in [SUBACK, UNSUBACK]:
+        if type_code in REASONS:
             topic['code'] = stream.get_byte()
-        packet['topics'].append(topic)
+        packet.topics.append(topic)
 
 def read_connect_packet(packet, stream):
     logging.info("Parsing CONNECT packet")
@@ -124,15 +150,15 @@ def read_connect_packet(packet, stream):
     else:
         if retain or qos != 0:
             raise MalformedPacketError("Bytes 3-5 reserved")
-    packet['clean_start'] = clean_start
-    packet['keep_alive'] = stream.get_int()
-    packet['properties'] = get_properties(stream, packet['type'])
-    packet['client_id'] = stream.get_string()
+    packet.clean_start = clean_start
+    packet.keep_alive = stream.get_int()
+    packet.properties = get_properties(stream, packet.type)
+    packet.client_id = stream.get_string()
     if will_flag:
         will_properties = get_properties(stream, WILL)
         topic = stream.get_string()
         payload = stream.get_binary()
-        packet['will'] = {
+        packet.will = {
             'qos': qos,
             'retain': retain,
             'topic': topic,
@@ -140,40 +166,60 @@ def read_connect_packet(packet, stream):
             'properties': will_properties
         }
     if username_flag:
-        packet['username'] = stream.get_string()
+        packet.username = stream.get_string()
     if password_flag:
-        packet['password'] = stream.get_binary()
+        packet.password = stream.get_binary()
+
+# Packet type code -> reader of variable header and payload
+READERS = {
+    packets.Connect.type_code: read_connect_packet,
+    packets.Connack.type_code: read_connack_packet,
+    packets.Publish.type_code: read_pub_packet,
+    packets.Puback.type_code: read_ack_packet,
+    packets.Pubrec.type_code: read_ack_packet,
+    packets.Pubrel.type_code: read_ack_packet,
+    packets.Pubcomp.type_code: read_ack_packet,
+    packets.Subscribe.type_code: read_sub_packet,
+    packets.Suback.type_code: read_sub_packet,
+    packets.Unsubscribe.type_code: read_sub_packet,
+    packets.Unsuback.type_code: read_sub_packet,
+    packets.Pingreq.type_code: read_ping_packet,
+    packets.Pingresp.type_code: read_ping_packet,
+    packets.Disconnect.type_code: read_reason_packet,
+    packets.Auth.type_code: read_reason_packet,
+}
 
 def get_properties(stream, packet_type):
     packed_properties = stream.get_properties()
     properties = {}
-    for prop in packed_properties:
-        code, value = prop[0], prop[1]
-        features = DICT[code]
+    allowed = codec.ALLOWED[packet_type]
+    lists = codec.LISTS[packet_type]
+    for code, value in packed_properties:
+        bit = 1 << code
+        name = codec.NAMES[code]
 
-        if packet_type not in features['group']:
+        if not allowed & bit:
             raise MalformedPacketError(f"Packet type ({packet_type})" +
-                f" does not support property ({features['name']})")
-        if features['bool'] and value not in range(2):
+                f" does not support property ({name})")
+        if codec.BOOL & bit and value not in range(2):
             raise ProtocolError(f"Value other than 0 or 1" + 
-                f" for property ({features['name']}) not allowed")
-        if features['nonzero'] and value == 0:
+                f" for property ({name}) not allowed")
+        if codec.NONZERO & bit and value == 0:
             raise ProtocolError(f"Value 0 " + 
-                f"for property ({features['name']}) not allowed")
+                f"for property ({name}) not allowed")
 
-        if (features['name'] == 'user_property' 
-            or (features['name'] == 'subscription_identifier' and packet_type == 'publish')):
-            if features['name'] not in properties:
-                properties[features['name']] = list()
-            properties[features['name']].append(value)
+        if lists & bit:
+            if name not in properties:
+                properties[name] = list()
+            properties[name].append(value)
         else:
-            if features['name'] in properties:
-                raise ProtocolError(f"Property ({features['name']})" +
+            if name in properties:
+                raise ProtocolError(f"Property ({name})" +
                     f" can't be included more than once")
-            properties[features['name']] = value
+            properties[name] = value
 
-    if DICT[AUTHENTICATION_DATA]['name'] in properties:
-        if DICT[AUTHENTICATION_METHOD]['name'] not in properties:
+    if 'authentication_data' in properties:
+        if 'authentication_method' not in properties:
             raise ProtocolError("Missing property authentication_method" +
             " for property authentication_data")
     return properties
@@ -255,22 +301,14 @@ def write_connect_packet(packet, stream):
 
 def put_properties(stream, unpacked_properties, packet_type='unknown'):
     properties = list()
-    for key in unpacked_properties:
-        value = unpacked_properties[key]
-        features = None
-        code = 0
-        for mcode in DICT:
-            mfeatures = DICT[mcode]
-            if mfeatures['name'] == key:
-                code = mcode
-                features = mfeatures
-                break
-        if features is None:
+    lists = codec.LISTS.get(packet_type, codec.DEFAULT_LISTS)
+    for key, value in unpacked_properties.items():
+        code = codec.CODES.get(key)
+        if code is None:
             continue
-        if (features['name'] == 'user_property' 
-            or (features['name'] == 'subscription_identifier' and packet_type == 'publish')):
+        if lists & (1 << code):
             for element in value:
                 properties.append((code, element))
         else:
             properties.append((code, value))
-    stream.put_properties(properties)
\ No newline at end of file
+    stream.put_properties(properties)
@@ -1,6 +1,11 @@
 import logging
+import struct
 from . import datatypes
 from . import const
+from . import codec
+
+TWO_BYTE_INT = struct.Struct(">H")
+FOUR_BYTE_INT = struct.Struct(">L")
 
 class PropertiesError(Exception):
     def __init__(self, message):
@@ -18,44 +23,47 @@ class MalformedVariableIntegerError(Exception):
     def __init__(self):
         super().__init__("Variable Byte Integer is malformed")
 
+# Packet type and flags of the first byte of a fixed header
+def decode_header(byte):
+    packet_type = const.get_type_str(byte & 0xF0)
+    dup = byte & 0x08 != 0
+    qos = (byte >> 1) & 0x03
+    retain = byte & 0x01 != 0
+    return (packet_type,
+            dup,
+            qos,
+            retain,
+            )
+
 class Stream():
-    def __init__(self):
-        self.buffer = b""
-        self.header = -1
-        self.size = -1
+    def __init__(self, data=None):
+        # Bytes are read from position on and written at the end of buffer,
+        # a stream over data given as memoryview can only be read
+        self.buffer = bytearray() if data is None else data
+        self.position = 0
         self.loading = False
 
     def load(self):
-        # if not isinstance(data, bytes):
-        #     raise ParameterError("Argument is not a bytes type")
-        # if not self.loading and self.buffer:
-        #     raise Exception("Cannot load new packet, old packet still in use")
         self.loading = True
-
-        # self.buffer += data
-        if self.header < 0:
-            value, index = datatypes.decode_byte(self.buffer)
-            if index < 0:
+        view = memoryview(self.buffer)[self.position:]
+        try:
+            if len(view) < 2:
                 return b""
-            self.buffer = self.buffer[index:]
-            self.header = value
-        if self.size < 0:
-            value, index = datatypes.decode_variable_byte_int(self.buffer)
-            if index < 0:
+            size, index = 0, 1
+            while True:
+                if index >= len(view):
+                    return b""
+                byte = view[index]
+                size |= (byte & 0x7F) << (7 * (index - 1))
+                index += 1
+                if byte & 0x80 == 0 or index > 4:
+                    break
+            if len(view) - index < size:
                 return b""
-            self.buffer = self.buffer[index:]
-            self.size = value
-
-        if len(self.buffer) < self.size:
-            return b""
-
-        data_left = self.buffer[self.size:]
-        self.buffer = self.buffer[:self.size]
-        self.buffer = (datatypes.encode_byte(self.header)
-                       + datatypes.encode_variable_byte_int(self.size)
-                       + self.buffer)
-        self.header = -1
-        self.size = -1
+            data_left = bytes(view[index + size:])
+        finally:
+            view.release()
+        del self.buffer[self.position + index + size:]
         self.loading = False
         return data_left
 
@@ -63,13 +71,20 @@ class Stream():
         return self.loading
 
     def output(self, size):
-        return self.buffer[:size]
+        return bytes(self.buffer[self.position:self.position + size])
 
     def update(self, size):
-        self.buffer = self.buffer[size:]
+        self.position += size
+        if self.position >= len(self.buffer):
+            self.buffer = bytearray()
+            self.position = 0
 
     def empty(self):
-        return not self.buffer
+        return self.position >= len(self.buffer)
+
+    # Bytes left to read
+    def remaining(self):
+        return len(self.buffer) - self.position
 
 #==========================++++++++++++++++==========================
 #                          +++++      +++++
@@ -77,68 +92,51 @@ class Stream():
 #                          +++++      +++++
 #==========================++++++++++++++++==========================
 
-    def get_byte(self):
-        value, index = datatypes.decode_byte(self.buffer)
-        if index < 0:
+    # Advance position over size bytes, returns position before
+    def skip(self, size):
+        position = self.position
+        if len(self.buffer) - position < size:
             raise OutOfBoundsError()
-        self.buffer = self.buffer[index:]
-        return value
+        self.position += size
+        return position
+
+    def get_byte(self):
+        position = self.skip(1)
+        return self.buffer[position]
 
     def get_int(self):
-        value, index = datatypes.decode_two_byte_int(self.buffer)
-        if index < 0:
-            raise OutOfBoundsError()
-        self.buffer = self.buffer[index:]
-        return value
+        return TWO_BYTE_INT.unpack_from(self.buffer, self.skip(2))[0]
 
     def get_long(self):
-        value, index = datatypes.decode_four_byte_int(self.buffer)
-        if index < 0:
-            raise OutOfBoundsError()
-        self.buffer = self.buffer[index:]
-        return value
+        return FOUR_BYTE_INT.unpack_from(self.buffer, self.skip(4))[0]
 
     def get_var_int(self):
-        value, index = datatypes.decode_variable_byte_int(self.buffer)
-        if index < 0:
-            raise OutOfBoundsError()
-        if index > 4:
-            raise MalformedVariableIntegerError()
-        self.buffer = self.buffer[index:]
-        return value
+        value = 0
+        for index in range(4):
+            byte = self.get_byte()
+            value |= (byte & 0x7F) << (7 * index)
+            if byte & 0x80 == 0:
+                return value
+        raise MalformedVariableIntegerError()
 
     def get_binary(self):
-        value, index = datatypes.decode_binary_data(self.buffer)
-        if index < 0:
-            raise OutOfBoundsError()
-        self.buffer = self.buffer[index:]
-        return value 
+        length = self.get_int()
+        position = self.skip(length)
+        return bytes(self.buffer[position:position + length])
 
     def get_string(self):
-        value, index = datatypes.decode_utf8_encoded_string(self.buffer)
-        if index < 0:
+        length = self.get_int()
+        position = self.skip(length)
+        try:
+            return str(self.buffer[position:position + length], 'utf-8')
+        except UnicodeDecodeError:
             raise OutOfBoundsError()
-        self.buffer = self.buffer[index:]
-        return value 
 
     def get_string_pair(self):
-        value, index = datatypes.decode_utf8_string_pair(self.buffer)
-        if index < 0:
-            raise OutOfBoundsError()
-        self.buffer = self.buffer[index:]
-        return value 
+        return self.get_string(), self.get_string()
 
     def get_header(self):
-        header = self.get_byte()
-        packet_type = const.get_type_str(header & 0xF0)
-        dup = header & 0x08 != 0
-        qos = (header >> 1) & 0x03
-        retain = header & 0x01 != 0
-        return (packet_type,
-                dup,
-                qos,
-                retain,
-                )
+        return decode_header(self.get_byte())
 
     def get_connect_flags(self):
         flags = self.get_byte()
@@ -183,44 +181,34 @@ class Stream():
     def get_properties(self):
         properties = list()
         length = self.get_var_int()
-        while length > 0:
-            code, index = datatypes.decode_variable_byte_int(self.buffer)
-            if index > length:
-                raise PropertiesError('Malformed Properties Length')
-            length -= index
-            self.buffer = self.buffer[index:]
-            if code not in const.DICT:
-                raise PropertiesError(f'Property not supported: {hex(code)}')
-            data_type = const.DICT[code]['type']
-            value, index = None, -1
-            if data_type == const.BYTE:
-                value, index = datatypes.decode_byte(self.buffer)
-            elif data_type == const.TWO_BYTE_INT:
-                value, index = datatypes.decode_two_byte_int(self.buffer)
-            elif data_type == const.FOUR_BYTE_INT:
-                value, index = datatypes.decode_four_byte_int(self.buffer)
-            elif data_type == const.VARIABLE_BYTE_INT:
-                value, index = datatypes.decode_variable_byte_int(self.buffer)
-            elif data_type == const.BINARY_DATA:
-                value, index = datatypes.decode_binary_data(self.buffer)
-            elif data_type == const.UTF8_ENCODED_STRING:
-                value, index = datatypes.decode_utf8_encoded_string(self.buffer)
-            elif data_type == const.UTF8_STRING_PAIR:
-                value, index = datatypes.decode_utf8_string_pair(self.buffer)
-            else:
-                raise PropertiesError('Data type not supported')
-            if index < 0:
-                raise OutOfBoundsError()
-            if index > length:
-                raise PropertiesError('Malformed Properties Length')
-            length -= index
-            self.buffer = self.buffer[index:]
-            properties.append((code, value))
+        buffer, position = self.buffer, self.position
+        end = position + length
+        if end > len(buffer):
+            raise OutOfBoundsError()
+        decoders = codec.DECODERS
+        try:
+            while position < end:
+                code, position = codec.decode_variable_byte_int(buffer, position)
+                decoder = decoders.get(code)
+                if decoder is None:
+                    raise PropertiesError(f'Property not supported: {hex(code)}')
+                value, position = decoder(buffer, position)
+                properties.append((code, value))
+        except (IndexError, struct.error, UnicodeDecodeError):
+            raise OutOfBoundsError()
+        if position > end:
+            raise PropertiesError('Malformed Properties Length')
+        self.position = position
         return properties
 
+    # Bytes left to read, the stream is empty afterwards
     def dump(self):
-        buf = self.buffer
-        self.buffer = b""
+        if self.position:
+            buf = bytes(memoryview(self.buffer)[self.position:])
+        else:
+            buf = bytes(self.buffer)
+        self.buffer = bytearray()
+        self.position = 0
         return buf
 
 #==========================+++++++++++++++++==========================
@@ -242,7 +230,8 @@ class Stream():
         self.buffer += datatypes.encode_variable_byte_int(value)
 
     def put_binary(self, value):
-        self.buffer += datatypes.encode_binary_data(value)
+        self.buffer += datatypes.encode_two_byte_int(len(value))
+        self.append(value)
 
     def put_string(self, value):
         self.buffer += datatypes.encode_utf8_encoded_string(value)
@@ -271,10 +260,10 @@ class Stream():
         if retain:
             byte |= 0x01
 
-        content = self.dump()
-        self.put_byte(byte)
-        self.put_var_int(len(content))
-        self.append(content)
+        # Fixed header goes in front of the unread content
+        header = datatypes.encode_byte(byte) + datatypes.encode_variable_byte_int(
+            len(self.buffer) - self.position)
+        self.buffer[self.position:self.position] = header
 
     def put_connect_flags(self,
                           username_flag,
@@ -344,37 +333,22 @@ class Stream():
     def put_properties(self, properties):
         if not isinstance(properties, list):
             raise ParameterError("Parameter for properties is not a list")
-        properties_buffer = b""
+        properties_buffer = bytearray()
         for prop in properties:
             if not isinstance(prop, tuple) or len(prop) < 2:
                 raise ParameterError("Parameter element is wrong type (2-sized tuple)")
 
             code, value = prop[0], prop[1]
-            if code not in const.DICT:
+            encoder = codec.ENCODERS.get(code)
+            if encoder is None:
                 raise PropertiesError(f'Property not supported: {hex(code)}')
-            properties_buffer += datatypes.encode_byte(code)
-            data_type = const.DICT[code]['type']
-            if data_type == const.BYTE:
-                properties_buffer += datatypes.encode_byte(value)
-            elif data_type == const.TWO_BYTE_INT:
-                properties_buffer += datatypes.encode_two_byte_int(value)
-            elif data_type == const.FOUR_BYTE_INT:
-                properties_buffer += datatypes.encode_four_byte_int(value)
-            elif data_type == const.VARIABLE_BYTE_INT:
-                properties_buffer += datatypes.encode_variable_byte_int(value)
-            elif data_type == const.BINARY_DATA:
-                properties_buffer += datatypes.encode_binary_data(value)
-            elif data_type == const.UTF8_ENCODED_STRING:
-                properties_buffer += datatypes.encode_utf8_encoded_string(value)
-            elif data_type == const.UTF8_STRING_PAIR:
-                properties_buffer += datatypes.encode_utf8_string_pair(value)
-            else:
-                raise PropertiesError('Data type not supported')
-
-        length = datatypes.encode_variable_byte_int(len(properties_buffer))
-        self.buffer += length + properties_buffer
+            properties_buffer += codec.IDENTIFIERS[code]
+            properties_buffer += encoder(value)
+
+        self.buffer += codec.encode_variable_byte_int(len(properties_buffer))
+        self.buffer += properties_buffer
 
     def append(self, value):
-        if not isinstance(value, bytes):
+        if not isinstance(value, (bytes, bytearray, memoryview)):
             raise ParameterError("Parameter is not a byte string")
         self.buffer += value
\ No newline at end of file
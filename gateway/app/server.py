@@ -6,22 +6,79 @@ import selectors
 import logging
 import os 
 
+import metrics
+
 LOGGER = logging.getLogger(__name__)
 
+RECV_SIZE = 4096
+MAX_RECV_SIZE = 262144
+SEND_SIZE = 65536
+# Pending connections queued by the kernel for each listener
+LISTEN_BACKLOG = 1024
+# Connections accepted per listener readiness event
+ACCEPT_BATCH = 64
+
+# Selector data of TLS sockets during handshake
+HANDSHAKE = 'handshake'
+
 class Server:
-    def __init__(self, host, port, safe_port):
+    def __init__(self, host, port, safe_port, reuse_port=False,
+                 backlog=LISTEN_BACKLOG, accept_batch=ACCEPT_BATCH):
         self.host = host
         self.port = port
         self.safe_port = safe_port
+        # Share listening ports with other processes, kernel balances connections
+        self.reuse_port = reuse_port
+        self.backlog = backlog
+        self.accept_batch = accept_batch
         self.stop_flag = False
         self.listener = None
         self.listener_safe = None
         self.selector = None
+        self.context = None
+        # TLS sockets whose read waits for the socket to be writable
+        self.read_on_write = set()
+        # Preallocated receive buffer, valid until the next read
+        self.recv_buffer = memoryview(bytearray(MAX_RECV_SIZE))
+        self.waker = None
+        self.waker_listener = None
+        self.metrics = metrics.Metrics()
+
+    def create_listener(self, port):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        listener.bind((self.host, port))
+        listener.listen(self.backlog)
+        self.register_listener(listener)
+        return listener
 
     def register_listener(self, listener):
         listener.setblocking(False)
         self.selector.register(listener, selectors.EVENT_READ, data=None)
 
+    def register_waker(self):
+        self.waker_listener, self.waker = socket.socketpair()
+        self.waker_listener.setblocking(False)
+        self.waker.setblocking(False)
+        self.selector.register(self.waker_listener, selectors.EVENT_READ, data=None)
+
+    # Interrupt blocking select, safe to call from any thread
+    def wakeup(self):
+        if self.waker is None: return
+        try:
+            self.waker.send(b'\x00')
+        except (BlockingIOError, OSError):
+            # Pipe already full or closed, loop is awake anyway
+            pass
+
+    def drain_waker(self):
+        try:
+            while self.waker_listener.recv(4096): pass
+        except (BlockingIOError, OSError):
+            pass
+
     def register_client(self, socket, data, mask):
         try:
             self.selector.get_key(socket)
@@ -30,6 +87,22 @@ class Server:
             socket.setblocking(False)
             self.selector.register(socket, mask, data=data)
 
+    def get_key(self, socket):
+        try:
+            return self.selector.get_key(socket)
+        except (KeyError, ValueError):
+            return None
+
+    # Register socket for the given events, unregister if there are none
+    def register_events(self, socket, data, read=True, write=False):
+        mask = 0
+        if read: mask |= selectors.EVENT_READ
+        if write: mask |= selectors.EVENT_WRITE
+        if mask:
+            self.register_client(socket, data, mask)
+        elif self.get_key(socket) is not None:
+            self.selector.unregister(socket)
+
     def register_read(self, socket, data):
         self.register_client(socket, data, selectors.EVENT_READ)
 
@@ -48,6 +121,7 @@ class Server:
             LOGGER.error('Client %s:%s: %s', addr[0], addr[1], e)
 
     def safe_close(self, socket):
+        self.read_on_write.discard(socket)
         try:
             socket.close()
         except OSError as e:
@@ -60,6 +134,8 @@ class Server:
                 self.unregister(self.listener)
             if self.listener_safe is not None:
                 self.unregister(self.listener_safe)
+            if self.waker_listener is not None:
+                self.unregister(self.waker_listener)
             self.selector.close()
             self.selector = None
         if self.listener is not None:
@@ -68,20 +144,34 @@ class Server:
         if self.listener_safe is not None:
             self.listener_safe.close()
             self.listener_safe = None
+        if self.waker is not None:
+            self.waker.close()
+            self.waker = None
+        if self.waker_listener is not None:
+            self.waker_listener.close()
+            self.waker_listener = None
+
+    def get_data(self, buff, size):
+        pass
 
-    def get_empty_buffer(self):
+    def set_position(self, buff, position):
         pass
 
-    def get_data(self, buff):
+    def is_empty(self, buff):
         pass
 
-    def set_position(self, buff):
+    def get_read_size(self, buff):
+        return RECV_SIZE
+
+    def on_start(self):
         pass
 
-    def is_empty(self, buff):
+    # TLS client accepted, handshake not done yet
+    def on_accept(self, socket):
         pass
 
-    def on_start(self):
+    # TLS handshake failed, client is closed
+    def on_reject(self, socket):
         pass
 
     def on_connect(self, socket):
@@ -102,31 +192,136 @@ class Server:
     def in_loop_action(self):
         pass
 
+    def has_pending(self):
+        return False
+
+    # Longest time the loop may block, None blocks until an event
+    def get_timeout(self):
+        return None
+
+    # Advance TLS handshake without blocking, hand over the client when done
+    def handshake(self, client):
+        try:
+            client.do_handshake()
+        except ssl.SSLWantReadError:
+            self.register_client(client, HANDSHAKE, selectors.EVENT_READ)
+            return
+        except ssl.SSLWantWriteError:
+            self.register_client(client, HANDSHAKE, selectors.EVENT_WRITE)
+            return
+        except (ssl.SSLError, OSError) as e:
+            LOGGER.info('TLS handshake failed: %s', e)
+            self.reject(client)
+            return
+        self.on_connect(client)
+
+    def reject(self, client):
+        if self.get_key(client) is not None: self.selector.unregister(client)
+        self.on_reject(client)
+        self.safe_close(client)
+
+    # Drain pending connections of listener, at most accept_batch at once
+    # so a reconnect storm does not starve connected clients
+    def accept(self, listener):
+        for i in range(self.accept_batch):
+            try:
+                client, addr = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # Out of file descriptors or connection reset before accept
+                LOGGER.error('Accept failed: %s', e)
+                return
+            client.setblocking(False)
+            self.metrics.inc('accepted')
+            self.metrics.mark('accepts_per_second')
+            if listener == self.listener_safe:
+                client = self.context.wrap_socket(client,
+                    server_side=True, do_handshake_on_connect=False)
+                self.on_accept(client)
+                self.handshake(client)
+            else:
+                self.on_connect(client)
+
+    # Receive into the shared buffer without allocating, returns a view of it
+    def recv(self, client, size=RECV_SIZE):
+        view = self.recv_buffer[:min(size, MAX_RECV_SIZE)]
+        received = client.recv_into(view)
+        if not isinstance(client, ssl.SSLSocket):
+            return view[:received]
+        # Decrypted bytes left in the TLS buffer do not wake the selector
+        while received and received < len(view) and client.pending():
+            received += client.recv_into(view[received:])
+        if received and client.pending():
+            return bytes(view[:received]) + client.recv(client.pending())
+        return view[:received]
+
+    # Send list of buffers with one system call
+    def send(self, client, buffers):
+        if isinstance(client, ssl.SSLSocket):
+            # TLS sockets do not support scatter/gather
+            return client.send(b"".join(buffers))
+        return client.sendmsg(buffers)
+
+    # Read from client, returns False if the client got disconnected
+    def read_client(self, client, buff):
+        try:
+            data = self.recv(client, self.get_read_size(buff))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return True
+        except ssl.SSLWantWriteError:
+            # TLS has to send before it can read, retry once the socket is writable
+            self.read_on_write.add(client)
+            self.register_client(client, buff, selectors.EVENT_READ | selectors.EVENT_WRITE)
+            return True
+        except OSError as e:
+            # Includes TLS errors of corrupted records and connection resets
+            LOGGER.info('Client %s: receive failed, %s', client.fileno(), e)
+            self.disconnect(client)
+            return False
+        if not data:
+            self.disconnect(client)
+            return False
+        self.metrics.inc('bytes_in', len(data))
+        self.on_read(client, data, buff)
+        return True
+
+    # Write queued data to client, unless reading changed the registration
+    def write_client(self, client):
+        key = self.get_key(client)
+        if key is None or not key.events & selectors.EVENT_WRITE: return
+        buff = key.data
+        data = self.get_data(buff, SEND_SIZE)
+        if data:
+            try:
+                sent = self.send(client, data)
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except OSError as e:
+                LOGGER.info('Client %s: send failed, %s', client.fileno(), e)
+                self.disconnect(client)
+                return
+            self.metrics.inc('bytes_out', sent)
+            self.set_position(buff, sent)
+        if self.is_empty(buff): self.on_write(client)
+
     def disconnect(self, client):
+        self.read_on_write.discard(client)
         self.on_disconnect(client)
         self.unregister(client)
         self.safe_close(client)
 
 
     def start(self):
-        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        context.load_cert_chain(certfile='cert.pem', keyfile='key.pem')
+        self.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.context.load_cert_chain(certfile='cert.pem', keyfile='key.pem')
 
         self.selector = selectors.DefaultSelector()
 
-        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        listener.bind((self.host, self.port))
-        listener.listen()
-        self.register_listener(listener)
-        self.listener = listener
+        self.listener = self.create_listener(self.port)
+        self.listener_safe = self.create_listener(self.safe_port)
 
-        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        listener.bind((self.host, self.safe_port))
-        listener.listen()
-        self.register_listener(listener)
-        self.listener_safe = listener
+        self.register_waker()
 
         self.on_start()
 
@@ -134,36 +329,32 @@ class Server:
 
             # Server loop                                                            // server.py
             while True:
-                # Processing events from sockets
-                events = self.selector.select(timeout=0)
+                # Processing events from sockets, block until a socket is ready
+                # or wakeup() is called, unless work is already pending
+                timeout = 0 if self.has_pending() else self.get_timeout()
+                events = self.selector.select(timeout=timeout)
                 for key, mask in events: 
+                    # Wakeup from another thread, work is handled in in_loop_action
+                    if key.fileobj is self.waker_listener:
+                        self.drain_waker()
                     # Accept new connection from client
-                    if key.data is None:
-                        listener = key.fileobj
-                        client, addr = listener.accept()
-                        if listener == self.listener_safe: 
-                            client = context.wrap_socket(client, server_side=True)
-                        self.register_client(client, self.get_empty_buffer(), selectors.EVENT_READ)
-                        self.on_connect(client)
+                    elif key.data is None:
+                        self.accept(key.fileobj)
+                    # Continue TLS handshake
+                    elif key.data is HANDSHAKE:
+                        self.handshake(key.fileobj)
                     else:
-                        client, package_buffer = key.fileobj, key.data
+                        client = key.fileobj
+                        # Retry read that had to wait for the TLS socket to be writable
+                        if mask & selectors.EVENT_WRITE and client in self.read_on_write:
+                            self.read_on_write.discard(client)
+                            mask |= selectors.EVENT_READ
                         # Read package from client
-                        if mask is selectors.EVENT_READ:
-                            try:
-                                data = client.recv(4096)
-                            except (BlockingIOError, ConnectionResetError):
-                                continue
-                            if not data: self.disconnect(client)
-                            else: self.on_read(client, data, package_buffer)
+                        if mask & selectors.EVENT_READ:
+                            if not self.read_client(client, key.data): continue
                         # Write package to client
-                        elif mask is selectors.EVENT_WRITE:
-                            data = self.get_data(package_buffer, 4096)
-                            try:
-                                sent = client.send(data)
-                            except BlockingIOError:
-                                continue
-                            self.set_position(package_buffer, sent)
-                            if self.is_empty(package_buffer): self.on_write(client)
+                        if mask & selectors.EVENT_WRITE:
+                            self.write_client(client)
                 # Additional processing in each iteration implemented by child class
                 self.in_loop_action() 
 
@@ -176,4 +367,5 @@ class Server:
             self.close()
 
     def stop(self):
-        self.stop_flag = True
\ No newline at end of file
+        self.stop_flag = True
+        self.wakeup()
\ No newline at end of file
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+
+LOGGER = logging.getLogger(__name__)
+
+STATS_INTERVAL_IN_SECONDS = 10
+
+# Gauges of a setting or the last value seen by one worker, aggregated as the
+# largest value; other gauges measure load and are summed to fleet totals
+MAX_GAUGES = {'inbox_batch_limit', 'inbox_last_batch'}
+
+# Send metrics of a worker to the supervisor periodically
+def start_reporter(metrics, index, stats, interval=STATS_INTERVAL_IN_SECONDS):
+    def report():
+        while True:
+            time.sleep(interval)
+            stats.put((index, metrics.snapshot()))
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+    return reporter
+
+# Add counters and histograms of snapshot to totals
+def add_totals(totals, snapshot):
+    counters = totals['counters']
+    for name, value in snapshot['counters'].items():
+        counters[name] = counters.get(name, 0) + value
+    for name, histogram in snapshot['histograms'].items():
+        total = totals['histograms'].setdefault(name, {'buckets': histogram['buckets'],
+                                                       'counts': [0] * len(histogram['counts']),
+                                                       'sum': 0})
+        total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+        total['sum'] += histogram['sum']
+
+class Supervisor:
+    def __init__(self, workers, target, interval=STATS_INTERVAL_IN_SECONDS):
+        self.workers = workers
+        # Function run by each worker process with arguments (index, stats)
+        self.target = target
+        self.interval = interval
+        self.processes = {}
+        self.snapshots = {}
+        # Counters and histograms of workers before they were restarted, so
+        # totals keep growing
+        self.offsets = {}
+        self.restarts = 0
+        self.stats = multiprocessing.Queue()
+
+    def spawn(self, index):
+        process = multiprocessing.Process(target=self.target,
+                                          args=(index, self.stats),
+                                          name=f'gateway-worker-{index}',
+                                          daemon=True)
+        process.start()
+        self.processes[index] = process
+        LOGGER.info('Worker %s started, pid %s', index, process.pid)
+
+    # Receive worker metrics until the reporting interval expires
+    def collect(self):
+        deadline = time.time() + self.interval
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0: break
+            try:
+                index, snapshot = self.stats.get(timeout=remaining)
+            except queue.Empty:
+                break
+            self.snapshots[index] = snapshot
+
+    # Restart crashed workers
+    def check(self):
+        for index, process in list(self.processes.items()):
+            if process.is_alive(): continue
+            LOGGER.error('Worker %s exited with code %s, restarting', index, process.exitcode)
+            snapshot = self.snapshots.pop(index, None)
+            if snapshot:
+                add_totals(self.offsets.setdefault(index, {'counters': {}, 'histograms': {}}), snapshot)
+            self.restarts += 1
+            self.spawn(index)
+
+    # Sum counters and histograms of all workers, including restarted ones,
+    # and load gauges; gauges are reported for each worker too
+    def aggregate(self):
+        totals = {'counters': {'worker_restarts': self.restarts}, 'histograms': {}}
+        gauges = {'workers': len(self.processes)}
+        workers = {}
+        for index, offset in sorted(list(self.offsets.items())):
+            add_totals(totals, offset)
+        for index, snapshot in sorted(list(self.snapshots.items())):
+            add_totals(totals, snapshot)
+            for name, value in snapshot['gauges'].items():
+                if name in MAX_GAUGES:
+                    gauges[name] = max(gauges.get(name, value), value)
+                else:
+                    gauges[name] = gauges.get(name, 0) + value
+            workers[index] = snapshot['gauges']
+        return {'counters': totals['counters'], 'gauges': gauges,
+                'histograms': totals['histograms'], 'workers': workers}
+
+    def start(self):
+        for index in range(self.workers):
+            self.spawn(index)
+        try:
+            while True:
+                self.collect()
+                self.check()
+                totals = self.aggregate()
+                LOGGER.info('Gateway stats: %s %s', totals['counters'], totals['gauges'])
+        except KeyboardInterrupt:
+            LOGGER.info('Caught keyboard interrupt, stopping workers...')
+        finally:
+            self.close()
+
+    def close(self):
+        for process in self.processes.values():
+            if process.is_alive(): process.terminate()
+        for process in self.processes.values():
+            process.join()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import math
+
+# Hierarchical timing wheel, scheduling and cancelling are O(1),
+# expiring is O(1) amortized per timer
+class TimerWheel:
+    def __init__(self, now, resolution=1.0, bits=6, levels=4):
+        self.resolution = resolution
+        self.bits = bits
+        self.slots = 1 << bits
+        self.mask = self.slots - 1
+        self.levels = levels
+        self.wheels = [[{} for i in range(self.slots)] for j in range(levels)]
+        self.counts = [0] * levels
+        # Timer key -> (level, slot)
+        self.timers = {}
+        self.current = int(math.floor(now / self.resolution))
+
+    # Timers never expire before their deadline, at most one tick late
+    def to_tick(self, time):
+        return int(math.ceil(time / self.resolution))
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def place(self, key, tick):
+        delta = max(tick - self.current, 0)
+        # Timers beyond the last level wait in its farthest slot and cascade again
+        position = tick
+        if delta >= 1 << (self.bits * self.levels):
+            delta = (1 << (self.bits * self.levels)) - 1
+            position = self.current + delta
+        level = 0
+        while level < self.levels - 1 and delta >= 1 << (self.bits * (level + 1)):
+            level += 1
+        slot = (position >> (self.bits * level)) & self.mask
+        self.wheels[level][slot][key] = tick
+        self.timers[key] = (level, slot)
+        self.counts[level] += 1
+
+    # Schedule or reschedule timer to expire at deadline
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        # Slot of the current tick was already expired, past deadlines go to the next one
+        self.place(key, max(self.to_tick(deadline), self.current + 1))
+
+    def cancel(self, key):
+        position = self.timers.pop(key, None)
+        if position is None: return
+        level, slot = position
+        del self.wheels[level][slot][key]
+        self.counts[level] -= 1
+
+    # Move timers of a higher level slot down to lower levels
+    def cascade(self, level):
+        slot = (self.current >> (self.bits * level)) & self.mask
+        timers = self.wheels[level][slot]
+        self.wheels[level][slot] = {}
+        self.counts[level] -= len(timers)
+        for key, tick in timers.items():
+            self.place(key, tick)
+
+    # Advance wheel to time now, returns keys of expired timers
+    def advance(self, now):
+        target = int(math.floor(now / self.resolution))
+        expired = []
+        while self.current < target:
+            if not self.timers:
+                self.current = target
+                break
+            # Skip ticks of empty lower levels up to the next cascade
+            level = 0
+            while level < self.levels - 1 and self.counts[level] == 0:
+                level += 1
+            if level > 0:
+                span = 1 << (self.bits * level)
+                self.current = min(target - 1, self.current | (span - 1))
+            self.current += 1
+            for level in range(self.levels - 1, 0, -1):
+                if self.current & ((1 << (self.bits * level)) - 1) == 0:
+                    self.cascade(level)
+            slot = self.current & self.mask
+            timers = self.wheels[0][slot]
+            if not timers: continue
+            self.wheels[0][slot] = {}
+            self.counts[0] -= len(timers)
+            for key in timers:
+                del self.timers[key]
+                expired.append(key)
+        return expired
+
+    # Seconds until the wheel has to be advanced, None if there are no timers
+    def next_timeout(self, now):
+        if not self.timers:
+            return None
+        # Wake up at the next cascade of the lowest level holding timers
+        level = 0
+        while self.counts[level] == 0:
+            level += 1
+        span = 1 << (self.bits * max(level, 1))
+        ticks = span - (self.current & (span - 1))
+        for distance in range(1, self.slots if level == 0 else 0):
+            if (self.current & self.mask) + distance >= self.slots:
+                break
+            if self.wheels[0][(self.current + distance) & self.mask]:
+                ticks = distance
+                break
+        return max((self.current + ticks) * self.resolution - now, 0)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# MQTT codec microbenchmarks, run from the gateway directory:
+#   python -m test.benchmark.codec            compare with the saved baseline
+#   python -m test.benchmark.codec --save     save results as the new baseline
+#   python -m test.benchmark.codec -k publish only cases containing publish
+
+import os
+import sys
+import json
+import timeit
+import argparse
+import tracemalloc
+
+from app.protocols import mqtt
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+PAYLOAD_SIZES = [0, 1024, 65536, 1 << 20]
+PROPERTY_COUNTS = [0, 4, 16]
+
+# Packet types only the server sends, encoded but never decoded by the gateway
+SERVER_ONLY = {'connack', 'suback'}
+
+# Packets of every type exchanged with clients, with count user properties
+def packets(count):
+    properties = {'user_property': [('key%d' % index, 'value%d' % index) for index in range(count)]}
+    if not count: properties = {}
+    return {
+        'connect': {'type': 'connect', 'client_id': 'client', 'keep_alive': 60, 'clean_start': True,
+                    'username': 'user', 'password': b'secret', 'properties': properties},
+        'connack': {'type': 'connack', 'code': 0, 'session_present': False, 'properties': properties},
+        'puback': {'type': 'puback', 'id': 1, 'code': 0, 'properties': properties},
+        'subscribe': {'type': 'subscribe', 'id': 1, 'properties': properties,
+                      'topics': [{'filter': 'sensors/+/temperature', 'max_qos': 1}]},
+        'suback': {'type': 'suback', 'id': 1, 'properties': properties, 'topics': [{'code': 1}]},
+        'disconnect': {'type': 'disconnect', 'code': 0, 'properties': properties},
+        'auth': {'type': 'auth', 'code': 0x18,
+                 'properties': dict(properties, authentication_method='OAuth2.0')},
+    }
+
+def cases():
+    for count in PROPERTY_COUNTS:
+        for size in PAYLOAD_SIZES:
+            yield ('publish/%dB/%dprops' % (size, count),
+                   {'type': 'publish', 'topic': 'sensors/1/temperature', 'qos': 1, 'id': 1,
+                    'properties': packets(count)['puback']['properties'], 'payload': b'x' * size})
+        for name, packet in packets(count).items():
+            yield '%s/%dprops' % (name, count), packet
+    yield 'pingreq', {'type': 'pingreq'}
+
+# Frame and parse the packet as the gateway does, from its receive buffer
+def decode(data, packet):
+    packets, remainder = mqtt.decode_all(data)
+    remainder.release()
+    return packets
+
+# Decode into the dictionary sent to the router
+def decode_full(data, packet):
+    for packet, error in decode(data, packet):
+        mqtt.request(packet)
+
+def encode(data, packet):
+    return mqtt.encode(packet)
+
+OPERATIONS = {'decode': decode, 'decode_full': decode_full, 'encode': encode}
+# Operations run on packets received from clients
+DECODING = {'decode', 'decode_full'}
+
+# Operations per second, best of repeat runs of at least 0.2 seconds, and
+# peak bytes allocated by one operation
+def measure(operation, data, packet, repeat):
+    timer = timeit.Timer(lambda: operation(data, packet))
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat, number)) / number
+
+    tracemalloc.start()
+    operation(data, packet)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return 1 / best, peak
+
+def run(repeat, pattern):
+    results = {}
+    for name, packet in cases():
+        data = mqtt.dump(mqtt.compose(dict(packet)))
+        for operation_name, operation in OPERATIONS.items():
+            if operation_name in DECODING and packet['type'] in SERVER_ONLY: continue
+            key = '%s %s' % (operation_name, name)
+            if pattern and pattern not in key: continue
+            # Received packets are decoded from a bytearray, which the
+            # parser copies payloads out of, like the gateway receive buffer
+            source = bytearray(data) if operation_name in DECODING else data
+            rate, peak = measure(operation, source, packet, repeat)
+            results[key] = {'packets_per_second': rate,
+                            'mb_per_second': rate * len(data) / 1e6,
+                            'peak_bytes': peak}
+    return results
+
+def change(value, base):
+    if not base: return ''
+    return '%+.0f%%' % ((value / base - 1) * 100)
+
+def report(results, baseline):
+    print('%-36s %12s %7s %10s %12s %7s' % ('case', 'packets/s', '', 'MB/s', 'peak bytes', ''))
+    for key, result in results.items():
+        base = baseline.get(key, {})
+        print('%-36s %12.0f %7s %10.1f %12d %7s' % (
+            key,
+            result['packets_per_second'], change(result['packets_per_second'], base.get('packets_per_second')),
+            result['mb_per_second'],
+            result['peak_bytes'], change(result['peak_bytes'], base.get('peak_bytes'))))
+
+def main(argv):
+    arguments = argparse.ArgumentParser(description='MQTT codec microbenchmarks')
+    arguments.add_argument('--baseline', default=BASELINE, help='baseline file to compare with')
+    arguments.add_argument('--save', action='store_true', help='save results as the baseline')
+    arguments.add_argument('--repeat', type=int, default=3, help='timed runs per measurement')
+    arguments.add_argument('-k', dest='pattern', default='', help='only cases containing pattern')
+    options = arguments.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+    results = run(options.repeat, options.pattern)
+    report(results, baseline)
+    if options.save:
+        baseline.update(results)
+        with open(options.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
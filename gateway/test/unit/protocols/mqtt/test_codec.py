@@ -0,0 +1,58 @@
+import unittest
+
+from app.protocols.mqtt import codec
+from app.protocols.mqtt import const
+from app.protocols.mqtt import datatypes
+
+values = {
+    const.BYTE: 0x90,
+    const.TWO_BYTE_INT: 513,
+    const.FOUR_BYTE_INT: 70000,
+    const.VARIABLE_BYTE_INT: 2097152,
+    const.BINARY_DATA: b'\x00\x01data',
+    const.UTF8_ENCODED_STRING: 'topic/ž',
+    const.UTF8_STRING_PAIR: ('key', 'value'),
+}
+
+class TestCodec(unittest.TestCase):
+
+    def test_names(self):
+        self.assertEqual(codec.CODES['user_property'], const.USER_PROPERTY)
+        self.assertEqual(codec.NAMES[const.TOPIC_ALIAS], 'topic_alias')
+        self.assertEqual(len(codec.NAMES), len(const.DICT))
+        self.assertEqual(const.get_type_str(0x30), const.PUBLISH)
+
+    def test_round_trip(self):
+        for code, features in const.DICT.items():
+            value = values[features['type']]
+            encoded = codec.ENCODERS[code](value)
+            buffer = b'\xff' + encoded
+            decoded, position = codec.DECODERS[code](buffer, 1)
+            self.assertEqual(decoded, value)
+            self.assertEqual(position, len(buffer))
+
+    def test_same_as_datatypes(self):
+        for value in [0, 127, 128, 16383, 16384, 268435455]:
+            self.assertEqual(codec.encode_variable_byte_int(value),
+                             datatypes.encode_variable_byte_int(value))
+        self.assertEqual(codec.encode_utf8_string_pair(('a', 'b')),
+                         datatypes.encode_utf8_string_pair(('a', 'b')))
+
+    def test_out_of_bounds(self):
+        with self.assertRaises(IndexError):
+            codec.decode_utf8_encoded_string(b'\x00\x05abc', 0)
+        with self.assertRaises(IndexError):
+            codec.decode_binary_data(b'\x00\x05abc', 0)
+        with self.assertRaises(IndexError):
+            codec.decode_variable_byte_int(b'\x80\x80\x80\x80\x01', 0)
+
+    def test_masks(self):
+        self.assertTrue(codec.ALLOWED[const.PUBLISH] & 1 << const.TOPIC_ALIAS)
+        self.assertFalse(codec.ALLOWED[const.CONNECT] & 1 << const.TOPIC_ALIAS)
+        self.assertTrue(codec.ALLOWED[const.WILL] & 1 << const.WILL_DELAY_INTERVAL)
+        self.assertTrue(codec.BOOL & 1 << const.RETAIN_AVAILABLE)
+        self.assertTrue(codec.LISTS[const.PUBLISH] & 1 << const.SUBSCRIPTION_IDENTIFIER)
+        self.assertFalse(codec.LISTS[const.SUBSCRIBE] & 1 << const.SUBSCRIPTION_IDENTIFIER)
+
+if __name__ == '__main__':
+    unittest.main()
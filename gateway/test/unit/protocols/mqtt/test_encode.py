@@ -0,0 +1,51 @@
+import unittest
+
+from app.protocols import mqtt
+
+class TestEncode(unittest.TestCase):
+
+    def publish(self, **fields):
+        packet = {'type': 'publish', 'topic': 'sensors/1', 'payload': b'\x00' * 300,
+                  'properties': {'user_property': [('unit', 'C')], 'content_type': 'raw'}}
+        packet.update(fields)
+        return packet
+
+    def test_same_bytes(self):
+        packets = [self.publish(),
+                   self.publish(qos=1, id=10, retain=True),
+                   self.publish(qos=2, id=11, dup=True, properties={}),
+                   self.publish(qos=1, id=12, properties={'subscription_identifier': [5, 1000],
+                                                          'content_type': 'raw'})]
+        for packet in packets:
+            expected = mqtt.dump(mqtt.compose(dict(packet)))
+            data = b''.join(mqtt.encode(dict(packet), {}))
+            self.assertEqual(mqtt.frame_size(data[:5]), len(data))
+            stream = mqtt.new_stream()
+            mqtt.append(stream, data)
+            mqtt.load_packet(stream)
+            decoded, error = mqtt.parse(stream)
+            self.assertFalse(error)
+            self.assertEqual(decoded['payload'], packet['payload'])
+            if 'subscription_identifier' not in packet['properties']:
+                self.assertEqual(data, expected)
+            else:
+                self.assertEqual(decoded['properties']['subscription_identifier'], [5, 1000])
+
+    def test_shared_suffix(self):
+        shared = {}
+        first = mqtt.encode(self.publish(qos=1, id=1), shared)
+        second = mqtt.encode(self.publish(qos=0), shared)
+        third = mqtt.encode(self.publish(qos=1, id=2, properties={
+            'user_property': [('unit', 'C')], 'content_type': 'raw',
+            'subscription_identifier': [7]}), shared)
+        self.assertEqual(len(shared), 1)
+        self.assertIs(first[1], second[1])
+        self.assertIs(first[1], third[1])
+        self.assertNotEqual(first[0], second[0])
+
+    def test_other_packets(self):
+        packet = {'type': 'pingresp'}
+        self.assertEqual(mqtt.encode(packet, {}), [b'\xd0\x00'])
+
+if __name__ == '__main__':
+    unittest.main()
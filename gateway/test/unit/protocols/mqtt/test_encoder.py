@@ -0,0 +1,39 @@
+import unittest
+
+from app.protocols import mqtt
+from app.protocols.mqtt import encoder
+
+class TestEncoder(unittest.TestCase):
+
+    def test_same_bytes(self):
+        packets = [
+            {'type': 'publish', 'topic': 'a/b', 'payload': b'x' * 200000, 'qos': 1, 'id': 3,
+             'retain': True, 'properties': {'user_property': [('k', 'v'), ('k', 'w')],
+                                            'message_expiry_interval': 60}},
+            {'type': 'publish', 'topic': 'a', 'payload': b''},
+            {'type': 'connack', 'code': 0, 'session_present': True,
+             'properties': {'assigned_client_identifier': 'c1'}},
+            {'type': 'puback', 'id': 7, 'code': 0},
+            {'type': 'disconnect', 'code': 0x81},
+            {'type': 'auth', 'code': 0x18, 'properties': {'authentication_method': 'OAuth2.0',
+                                                          'authentication_data': b'uri'}},
+            {'type': 'suback', 'id': 9, 'topics': [{'code': 0}, {'code': 0x80}]},
+            {'type': 'subscribe', 'id': 9, 'topics': [{'filter': 'a/#', 'max_qos': 1,
+                                                       'no_local': True}]},
+            {'type': 'unsubscribe', 'id': 2, 'topics': [{'filter': 'a/#'}]},
+            {'type': 'pingresp'},
+            {'type': 'connect', 'client_id': 'c', 'keep_alive': 30, 'clean_start': True,
+             'username': 'u', 'password': b'p', 'properties': {'receive_maximum': 10},
+             'will': {'qos': 1, 'retain': False, 'topic': 'w', 'payload': b'bye',
+                      'properties': {}}},
+        ]
+        for packet in packets:
+            expected = mqtt.dump(mqtt.compose(dict(packet)))
+            self.assertEqual(encoder.encode(dict(packet)), expected, packet['type'])
+
+    def test_encode_list(self):
+        data = mqtt.encode({'type': 'puback', 'id': 1, 'code': 0})
+        self.assertEqual(b''.join(data), b'\x40\x04\x00\x01\x00\x00')
+
+if __name__ == '__main__':
+    unittest.main()
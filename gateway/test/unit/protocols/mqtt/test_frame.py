@@ -0,0 +1,75 @@
+import unittest
+
+from app.protocols import mqtt
+
+class TestFrame(unittest.TestCase):
+
+    def test_frame_size(self):
+        self.assertEqual(mqtt.frame_size(b'\xc0\x00'), 2)
+        self.assertEqual(mqtt.frame_size(b'\x30\x7f'), 129)
+        self.assertEqual(mqtt.frame_size(b'\x30\x80\x01'), 131)
+        self.assertEqual(mqtt.frame_size(b'\x30\xfc\xff\x7f'), mqtt.MAX_PACKET_SIZE)
+
+    def test_incomplete(self):
+        self.assertEqual(mqtt.frame_size(b''), mqtt.FRAME_INCOMPLETE)
+        self.assertEqual(mqtt.frame_size(b'\x30'), mqtt.FRAME_INCOMPLETE)
+        self.assertEqual(mqtt.frame_size(b'\x30\x80\x80'), mqtt.FRAME_INCOMPLETE)
+
+    def test_malformed(self):
+        self.assertEqual(mqtt.frame_size(b'\x30\x80\x80\x80\x80'), mqtt.FRAME_MALFORMED)
+        packet = mqtt.frame_error(mqtt.FRAME_MALFORMED)
+        self.assertEqual(mqtt.dump(mqtt.compose(packet)), b'\xe0\x02\x81\x00')
+
+    def test_too_large(self):
+        self.assertEqual(mqtt.frame_size(b'\x30\xff\xff\xff\x7f'), mqtt.FRAME_TOO_LARGE)
+        self.assertEqual(mqtt.frame_size(b'\x30\x80\x01', max_size=100), mqtt.FRAME_TOO_LARGE)
+        packet = mqtt.frame_error(mqtt.FRAME_TOO_LARGE)
+        self.assertEqual(mqtt.dump(mqtt.compose(packet)), b'\xe0\x02\x95\x00')
+
+    def test_read_frame(self):
+        publish = mqtt.dump(mqtt.compose({'type': 'publish', 'topic': 't', 'qos': 1, 'id': 3,
+                                          'payload': b'abc', 'properties': {}}))
+        view = memoryview(publish + b'\xc0\x00\x30\x05')
+        frame, size = mqtt.read_frame(view)
+        self.assertEqual(size, len(publish))
+        self.assertEqual(frame[0], 0x32)
+        self.assertEqual(frame[1], len(publish) - 2)
+        self.assertEqual(bytes(frame[2]), publish[2:])
+        packet, error = mqtt.parse_frame(frame)
+        self.assertFalse(error)
+        self.assertEqual((packet['topic'], packet['id'], packet['payload']), ('t', 3, b'abc'))
+        frame, size = mqtt.read_frame(view, len(publish))
+        self.assertEqual(size, 2)
+        self.assertEqual(mqtt.parse_frame(frame), ({'type': 'pingreq'}, False))
+        self.assertEqual(mqtt.read_frame(view, len(publish) + 2), (None, mqtt.FRAME_INCOMPLETE))
+
+    def test_read_frame_error(self):
+        frame, size = mqtt.read_frame(memoryview(b'\x30\x80\x80\x80\x80\x01'))
+        self.assertIsNone(frame)
+        self.assertEqual(size, mqtt.FRAME_MALFORMED)
+        packet, error = mqtt.parse_frame((0x00, 0, memoryview(b'')))
+        self.assertTrue(error)
+        self.assertEqual(packet['code'], 0x81)
+
+    def test_decode_all(self):
+        publish = mqtt.dump(mqtt.compose({'type': 'publish', 'topic': 't',
+                                          'payload': b'abc', 'properties': {}}))
+        buffer = bytearray(publish * 50 + b'\xc0\x00' + publish[:4])
+        packets, remainder = mqtt.decode_all(buffer)
+        self.assertEqual(len(packets), 51)
+        self.assertTrue(all(packet['payload'] == b'abc' for packet, error in packets[:50]))
+        self.assertEqual(packets[50], ({'type': 'pingreq'}, False))
+        self.assertEqual(bytes(remainder), publish[:4])
+        remainder.release()
+        del buffer[:len(buffer) - 4]
+
+    def test_decode_all_errors(self):
+        packets, remainder = mqtt.decode_all(b'\xc0\x00\x00\x00\x30\x80\x80\x80\x80\x01\xc0\x00')
+        self.assertEqual(packets[0], ({'type': 'pingreq'}, False))
+        self.assertTrue(packets[1][1])
+        self.assertEqual(packets[2], (mqtt.frame_error(mqtt.FRAME_MALFORMED), True))
+        self.assertEqual(len(packets), 3)
+        self.assertEqual(bytes(remainder), b'')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+
+from app.protocols import mqtt
+from app.protocols.mqtt import packets
+
+class TestPublish(unittest.TestCase):
+
+    def setUp(self):
+        self.packet = {'type': 'publish', 'dup': False, 'qos': 1, 'retain': True, 'topic': 'a/b',
+                       'id': 5, 'properties': {'user_property': [('k', 'v')],
+                                               'message_expiry_interval': 30},
+                       'payload': b'x' * 1000}
+        self.data = mqtt.dump(mqtt.compose(dict(self.packet)))
+
+    def decode(self, data):
+        (packet, error), = mqtt.decode_all(data)[0]
+        self.assertFalse(error)
+        return packet
+
+    def test_decode(self):
+        packet = self.decode(self.data)
+        self.assertIsInstance(packet, packets.Publish)
+        self.assertEqual((packet['type'], packet['topic'], packet['id']), ('publish', 'a/b', 5))
+        self.assertEqual(packet.to_dict(), self.packet)
+        self.assertEqual(mqtt.request(packet), self.packet)
+
+    # Payload is copied out of the receive buffer once
+    def test_receive_buffer(self):
+        buffer = bytearray(self.data)
+        packet = self.decode(buffer)
+        buffer[-1:] = b'y'
+        self.assertEqual(packet['payload'], b'x' * 1000)
+        self.assertIs(type(packet['payload']), bytes)
+
+    def test_fields(self):
+        packet = self.decode(mqtt.dump(mqtt.compose({'type': 'publish', 'topic': 't'})))
+        self.assertNotIn('id', packet)
+        self.assertIsNone(packet.get('id'))
+        packet['command'] = 'process'
+        self.assertEqual(packet.to_dict()['command'], 'process')
+
+    def test_encode(self):
+        packet = self.decode(self.data)
+        self.assertEqual(b''.join(mqtt.encode(packet)), self.data)
+
+    def test_malformed_properties(self):
+        # Property length runs past the end of the packet
+        data = bytearray(self.data)
+        data[10] = 0x7F
+        (response, error), = mqtt.decode_all(bytes(data))[0]
+        self.assertTrue(error)
+        self.assertEqual(response, {'type': 'disconnect', 'code': 0x81})
+
+    def test_malformed_topic(self):
+        (packet, error), = mqtt.decode_all(b'\x30\x03\x00\x05a')[0]
+        self.assertTrue(error)
+
+class TestPackets(unittest.TestCase):
+
+    def decode(self, packet):
+        (decoded, error), = mqtt.decode_all(mqtt.dump(mqtt.compose(dict(packet))))[0]
+        return decoded, error
+
+    def test_classes(self):
+        cases = [
+            (packets.Connect, {'type': 'connect', 'clean_start': True, 'keep_alive': 10,
+                               'properties': {'receive_maximum': 5}, 'client_id': 'c',
+                               'username': 'u'}),
+            (packets.Puback, {'type': 'puback', 'id': 4, 'code': 0, 'properties': {}}),
+            (packets.Pubrel, {'type': 'pubrel', 'id': 4, 'code': 0, 'properties': {}}),
+            (packets.Subscribe, {'type': 'subscribe', 'id': 2, 'properties': {},
+                                 'topics': [{'filter': 'a/#', 'max_qos': 1, 'retain_handling': 0,
+                                             'no_local': False, 'retain_as_published': False}]}),
+            (packets.Unsubscribe, {'type': 'unsubscribe', 'id': 2, 'properties': {},
+                                   'topics': [{'filter': 'a/#'}]}),
+            (packets.Pingreq, {'type': 'pingreq'}),
+            (packets.Disconnect, {'type': 'disconnect', 'code': 0, 'properties': {}}),
+            (packets.Auth, {'type': 'auth', 'code': 0x18,
+                            'properties': {'authentication_method': 'OAuth2.0'}}),
+        ]
+        for cls, packet in cases:
+            decoded, error = self.decode(packet)
+            self.assertFalse(error)
+            self.assertIs(type(decoded), cls)
+            self.assertEqual(packets.CLASSES[decoded.type_code], cls)
+            self.assertEqual(decoded.to_dict(), packet)
+            self.assertEqual(decoded, packet)
+            self.assertFalse(hasattr(decoded, '__dict__'))
+
+    def test_optional_fields(self):
+        decoded, error = self.decode({'type': 'connect', 'client_id': 'c', 'properties': {}})
+        self.assertNotIn('will', decoded)
+        self.assertIsNone(decoded.get('password'))
+        self.assertEqual(mqtt.keep_alive(decoded), 0)
+        self.assertTrue(mqtt.is_connect(decoded))
+        decoded['command'] = 'process'
+        self.assertEqual(mqtt.request(decoded)['command'], 'process')
+
+    # Checking a field does not compute it
+    def test_has(self):
+        class Counted(packets.Puback):
+            __slots__ = ('reads',)
+            FIELDS = ('type', 'id', 'code', 'properties', 'size')
+
+            @property
+            def size(self):
+                self.reads += 1
+                return 2
+
+        packet = Counted()
+        packet.reads = 0
+        packet.id = 1
+        self.assertTrue(packet.has('id'))
+        self.assertFalse(packet.has('code'))
+        self.assertTrue('size' in packet)
+        self.assertEqual(packet.reads, 0)
+        self.assertEqual(packet.to_dict(), {'type': 'puback', 'id': 1, 'size': 2})
+        self.assertEqual(packet.reads, 1)
+
+    def test_server_only(self):
+        decoded, error = self.decode({'type': 'suback', 'id': 1, 'topics': [{'code': 0}]})
+        self.assertEqual((decoded, error), ({'type': 'disconnect', 'code': 0x82}, True))
+        decoded, error = self.decode({'type': 'connack', 'code': 0, 'properties': {}})
+        self.assertTrue(error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -154,6 +154,42 @@ class TestStream(unittest.TestCase):
             # self.assertEqual(s.get_var_int(), 60)
             self.assertEqual(s.get_properties(), props)
 
+    def test_load_leftover(self):
+        s = stream.Stream()
+        s.append(b'\x30\x05\x00\x01ahi\xc0')
+        self.assertEqual(s.load(), b'\xc0')
+        self.assertFalse(s.still_loading())
+        self.assertEqual(s.dump(), b'\x30\x05\x00\x01ahi')
+        s.append(b'\x30\x80')
+        self.assertEqual(s.load(), b'')
+        self.assertTrue(s.still_loading())
+
+    def test_large_payload(self):
+        payload = bytes(range(256)) * 1024
+        s = stream.Stream()
+        s.put_string('topic')
+        s.append(payload)
+        s.put_header('publish')
+        data = s.dump()
+        s.append(data)
+        self.assertEqual(s.load(), b'')
+        self.assertEqual(s.get_byte(), 0x30)
+        self.assertEqual(s.get_var_int(), len(payload) + 7)
+        self.assertEqual(s.get_string(), 'topic')
+        self.assertEqual(s.remaining(), len(payload))
+        self.assertEqual(s.dump(), payload)
+        self.assertTrue(s.empty())
+
+    def test_out_of_bounds(self):
+        s = stream.Stream()
+        s.append(b'\x00\x05abc')
+        with self.assertRaises(stream.OutOfBoundsError):
+            s.get_string()
+        s = stream.Stream()
+        s.append(b'\x80\x80\x80\x80\x01')
+        with self.assertRaises(stream.MalformedVariableIntegerError):
+            s.get_var_int()
+
     def test_put_properties(self):
         props = [(const.USER_PROPERTY, ('a', 'b'))]
         for prop in props:
@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import queue
+import unittest
+import threading
+import concurrent.futures
+
+os.environ['AMQP_URL'] = 'AMQP_URL'
+
+from app import abstract_service
+
+class Properties:
+    def __init__(self, content_type=abstract_service.BINARY_CONTENT_TYPE, message_id=None,
+                 correlation_id='7'):
+        self.content_type = content_type
+        self.reply_to = 'reply'
+        self.correlation_id = correlation_id
+        self.message_id = message_id
+
+class Service(abstract_service.AbstractService):
+    def __init__(self):
+        abstract_service.AbstractService.__init__(self)
+        self.requests = queue.Queue()
+
+    def publish(self, request, queue, correlation_id=None, reply_queue=None,
+                content_type=abstract_service.CONTENT_TYPE, message_id=None):
+        self.published = (request, queue, correlation_id, content_type)
+        self.requests.put((correlation_id, reply_queue, message_id))
+
+    # Respond to the next call, as the responding service would
+    def respond(self, response, echo=True):
+        correlation_id, reply_queue, message_id = self.requests.get(timeout=1)
+        self.on_response(None, None, Properties(message_id=message_id if echo else None,
+                                                correlation_id=correlation_id),
+                         abstract_service.encode_body(response, abstract_service.BINARY_CONTENT_TYPE))
+
+# Connection delivering responses when the caller processes events
+class Connection:
+    def __init__(self, service, responses):
+        self.service = service
+        self.responses = responses
+
+    def process_data_events(self, time_limit=0):
+        if self.responses:
+            self.service.respond(*self.responses.pop(0))
+
+# Consumer thread delivering responses while other threads wait for them
+class ConsumerService(Service):
+    def run(self):
+        self.respond({'email': 'a@b'})
+
+class TestEnvelope(unittest.TestCase):
+
+    request = {'command': 'process', 'type': 'publish', 'topic': 't', 'qos': 1,
+               'payload': b'\x00\xff' * 1000, 'properties': {'user_property': [['k', 'v']]}}
+
+    def test_binary(self):
+        body = abstract_service.encode_body(self.request, abstract_service.BINARY_CONTENT_TYPE)
+        decoded = abstract_service.decode_body(body, abstract_service.BINARY_CONTENT_TYPE)
+        self.assertEqual(decoded, self.request)
+        self.assertIsInstance(decoded['payload'], bytes)
+        json_body = abstract_service.encode_body(self.request, abstract_service.JSON_CONTENT_TYPE)
+        self.assertLess(len(body), len(json_body) * 0.8)
+
+    def test_json_fallback(self):
+        body = json.dumps(self.request, cls=abstract_service.BytesEncoder).encode('utf-8')
+        self.assertEqual(abstract_service.decode_body(body, 'text/json'), self.request)
+        self.assertEqual(abstract_service.decode_body(body, None), self.request)
+
+    def test_default(self):
+        self.assertEqual(abstract_service.CONTENT_TYPE, abstract_service.BINARY_CONTENT_TYPE)
+
+    def test_reply_in_request_envelope(self):
+        service = Service()
+        service.reply_to_sender({'state': 'read'}, Properties('text/json'))
+        self.assertEqual(service.published[3], abstract_service.JSON_CONTENT_TYPE)
+        service.reply_to_sender({'state': 'read'}, Properties(abstract_service.BINARY_CONTENT_TYPE, '3'))
+        self.assertEqual(service.published[3], abstract_service.BINARY_CONTENT_TYPE)
+        self.assertEqual(service.requests.queue[-1], ('7', None, '3'))
+
+class TestRpc(unittest.TestCase):
+
+    def test_response(self):
+        service = Service()
+        service._connection = Connection(service, [({'email': 'a@b'},)])
+        self.assertEqual(service.rpc({'command': 'get_session'}, 'subscriptions', 'c1'), {'email': 'a@b'})
+        self.assertEqual(service.requests.qsize(), 0)
+        self.assertEqual(service._calls, {})
+
+    def test_correlation_fallback(self):
+        service = Service()
+        service._connection = Connection(service, [({'ok': True}, False)])
+        self.assertEqual(service.rpc({}, 'subscriptions', 'c1'), {'ok': True})
+
+    def test_timeout(self):
+        service = Service()
+        service._connection = Connection(service, [])
+        with self.assertRaises(Exception):
+            service.rpc({}, 'subscriptions', 'c1', timeout=0.05)
+        self.assertEqual(service._calls, {})
+        # Late response is dropped
+        service.respond({'late': True})
+
+    def test_other_thread(self):
+        service = ConsumerService()
+        service.start()
+        self.assertEqual(service.rpc({}, 'subscriptions', 'c1'), {'email': 'a@b'})
+        service.join(1)
+
+class Method:
+    def __init__(self, delivery_tag, redelivered=False):
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+
+# Channel delivering requests once, acknowledgements are recorded
+class Channel:
+    def __init__(self, service, requests):
+        self.service = service
+        self.requests = requests
+        self.acks = []
+        self.nacks = []
+
+    def consume(self, queue, inactivity_timeout=None):
+        for tag, (correlation_id, request) in enumerate(self.requests, 1):
+            body = abstract_service.encode_body(request, abstract_service.BINARY_CONTENT_TYPE)
+            yield Method(tag), Properties(correlation_id=correlation_id), body
+        self.service.close()
+        yield None, None, None
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.service.log.append(('publish', self, routing_key))
+
+    def tx_commit(self):
+        self.service.log.append(('commit', self))
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple, self.service.name == threading.current_thread().name))
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.nacks.append((delivery_tag, requeue))
+
+    def cancel(self):
+        pass
+
+# Connection running callbacks of other threads when processing events
+class ThreadsafeConnection:
+    def __init__(self):
+        self.callbacks = queue.Queue()
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+    def process_data_events(self, time_limit=0):
+        while not self.callbacks.empty():
+            self.callbacks.get()()
+
+class WorkerService(abstract_service.AbstractService):
+    def __init__(self, requests, workers):
+        abstract_service.AbstractService.__init__(self)
+        self._workers = [concurrent.futures.ThreadPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.actions = {'work': self.work, 'fan_out': self.fan_out, 'fail': self.fail, 'call': self.call}
+        self.done = []
+        self.log = []
+        self.requests = requests
+
+    def connect(self):
+        self._connection = ThreadsafeConnection()
+        self._channel = Channel(self, self.requests)
+        self._publish_channel = Channel(self, []) if self._confirms else self._channel
+        self._lock.release()
+
+    # Publish count requests, consumed requests are logged as published
+    def fan_out(self, request, props):
+        self.log.append(('consumed', request['count']))
+        for index in range(request['count']):
+            self.publish({'index': index}, 'clients')
+
+    def work(self, request, props):
+        time.sleep(0.001 * (request['index'] % 3))
+        self.done.append((props.correlation_id, request['index']))
+
+    def fail(self, request, props):
+        raise ValueError('failed')
+
+    # Waits for the connection thread like rpc() does
+    def call(self, request, props):
+        future = concurrent.futures.Future()
+        self._connection.add_callback_threadsafe(lambda: future.set_result(True))
+        self.done.append((props.correlation_id, future.result(2)))
+
+class TestPublish(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = abstract_service.PUBLISH_BATCH, abstract_service.PUBLISH_DELAY_IN_SECONDS
+        abstract_service.PUBLISH_BATCH, abstract_service.PUBLISH_DELAY_IN_SECONDS = 4, 60
+
+    def tearDown(self):
+        abstract_service.PUBLISH_BATCH, abstract_service.PUBLISH_DELAY_IN_SECONDS = self.batch
+
+    def run_service(self, confirms=False):
+        service = WorkerService([('0', {'command': 'fan_out', 'count': 3}),
+                                 ('1', {'command': 'fan_out', 'count': 9})], 0)
+        service._confirms = confirms
+        service.start()
+        service.join(5)
+        return [entry[0] for entry in service.log], service
+
+    def test_flush_per_request(self):
+        log, service = self.run_service()
+        # Flushed after each consumed request and after every 4 buffered
+        self.assertEqual(log, ['consumed'] + ['publish'] * 3
+                         + ['consumed'] + ['publish'] * 4 + ['publish'] * 4 + ['publish'])
+
+    def test_confirms(self):
+        log, service = self.run_service(confirms=True)
+        self.assertEqual(log, ['consumed'] + ['publish'] * 3 + ['commit']
+                         + ['consumed'] + ['publish'] * 4 + ['commit'] + ['publish'] * 4 + ['commit']
+                         + ['publish', 'commit'])
+        self.assertTrue(all(entry[1] is service._publish_channel
+                            for entry in service.log if entry[0] != 'consumed'))
+
+    def test_not_running(self):
+        service = WorkerService([], 0)
+        service.connect()
+        service.publish({}, 'clients')
+        self.assertEqual([entry[0] for entry in service.log], ['publish'])
+
+class TestWorkers(unittest.TestCase):
+
+    def run_service(self, workers):
+        requests = [(str(index % 4), {'command': 'work', 'index': index}) for index in range(40)]
+        requests.append(('0', {'command': 'unknown'}))
+        service = WorkerService(requests, workers)
+        service.start()
+        service.join(5)
+        self.assertEqual(sorted(tag for tag, multiple, on_thread in service._channel.acks), list(range(1, 42)))
+        # Acknowledged on the connection thread
+        self.assertTrue(all(on_thread for tag, multiple, on_thread in service._channel.acks))
+        for cid in '0123':
+            indexes = [index for done_cid, index in service.done if done_cid == cid]
+            self.assertEqual(indexes, sorted(indexes))
+            self.assertEqual(len(indexes), 10)
+
+    def test_workers(self):
+        self.run_service(3)
+
+    def test_connection_thread(self):
+        self.run_service(0)
+
+    # Stopping waits for workers while serving their calls
+    def test_drain(self):
+        service = WorkerService([('0', {'command': 'call'})], 1)
+        service.start()
+        service.join(5)
+        self.assertEqual(service.done, [('0', True)])
+        self.assertEqual(service._channel.acks, [(1, False, True)])
+
+    # Failed requests are requeued, not acknowledged
+    def test_failed(self):
+        service = WorkerService([('0', {'command': 'fail'}), ('1', b'not msgpack')], 2)
+        service.start()
+        service.join(5)
+        self.assertEqual(service._channel.acks, [])
+        self.assertEqual(sorted(service._channel.nacks), [(1, True), (2, True)])
+
+    # Requests failing again after redelivery are dropped
+    def test_redelivered(self):
+        service = WorkerService([], 0)
+        service.connect()
+        service.execute(abstract_service.encode_body({'command': 'fail'}, abstract_service.BINARY_CONTENT_TYPE),
+                        Properties(), Method(3, redelivered=True))
+        service._connection.process_data_events()
+        self.assertEqual(service._channel.nacks, [(3, False)])
+
+class TestAcks(unittest.TestCase):
+
+    def setUp(self):
+        self.delay = abstract_service.ACK_DELAY_IN_SECONDS
+        abstract_service.ACK_DELAY_IN_SECONDS = 60
+
+    def tearDown(self):
+        abstract_service.ACK_DELAY_IN_SECONDS = self.delay
+
+    def run_service(self, workers):
+        requests = [(str(index % 4), {'command': 'work', 'index': index}) for index in range(40)]
+        requests[5] = ('1', {'command': 'fail'})
+        requests.append(('0', b'not msgpack'))
+        service = WorkerService(requests, workers)
+        service._ack_batch = 8
+        service.start()
+        service.join(5)
+        self.assertEqual(sorted(service._channel.nacks), [(6, True), (41, True)])
+        return service._channel.acks
+
+    def test_batches(self):
+        acks = self.run_service(0)
+        # Every 8 handled requests, failed requests were rejected
+        self.assertEqual(acks, [(8, True, True), (16, True, True), (24, True, True),
+                                (32, True, True), (40, True, True)])
+
+    def test_workers(self):
+        acks = self.run_service(3)
+        tags = [tag for tag, multiple, on_thread in acks]
+        self.assertEqual(tags, sorted(tags))
+        self.assertEqual(tags[-1], 40)
+        self.assertTrue(all(multiple and on_thread for tag, multiple, on_thread in acks))
+
+    # Rejected requests are not acknowledged again
+    def test_rejected(self):
+        service = WorkerService([], 0)
+        service._ack_batch = 3
+        service.connect()
+        service.complete(1, failed=True)
+        service.flush_acks(force=True)
+        self.assertEqual(service._channel.acks, [])
+        service.complete(2)
+        service.complete(3, failed=True)
+        service.flush_acks(force=True)
+        self.assertEqual(service._channel.acks, [(2, True, False)])
+        self.assertEqual(service._channel.nacks, [(1, True), (3, True)])
+
+    # Acknowledged up to the last request handled with all before it
+    def test_out_of_order(self):
+        service = WorkerService([], 0)
+        service._ack_batch = 3
+        service.connect()
+        for tag in (2, 3, 4):
+            service.acknowledge(tag)
+        self.assertEqual(service._channel.acks, [])
+        service.acknowledge(1)
+        self.assertEqual(service._channel.acks, [(4, True, False)])
+        service.acknowledge(6)
+        service.flush_acks(force=True)
+        self.assertEqual(service._channel.acks, [(4, True, False)])
+        service.acknowledge(5)
+        service.flush_acks(force=True)
+        self.assertEqual(service._channel.acks, [(4, True, False), (6, True, False)])
+
+    def test_delay(self):
+        service = WorkerService([], 0)
+        service._ack_batch = 3
+        service.connect()
+        service.acknowledge(1)
+        self.assertEqual(service._channel.acks, [])
+        abstract_service.ACK_DELAY_IN_SECONDS = 0
+        service.flush_acks()
+        self.assertEqual(service._channel.acks, [(1, True, False)])
+
+if __name__ == '__main__':
+    unittest.main()
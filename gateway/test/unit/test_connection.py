@@ -0,0 +1,88 @@
+import socket
+import unittest
+
+from app import connection
+
+class TestConnection(unittest.TestCase):
+
+    def init(self, window=4):
+        self.sockets = socket.socketpair()
+        self.conn = connection.Connection(self.sockets[0], window)
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def test_output(self):
+        self.init()
+        self.conn.write(b'abc')
+        self.conn.write(b'')
+        self.conn.write(b'defg')
+        self.assertEqual(len(self.conn.output), 2)
+        buffers = self.conn.peek_output(100)
+        self.assertEqual(b''.join(buffers), b'abcdefg')
+        # Partial send inside the first buffer
+        self.conn.consume_output(2)
+        self.assertEqual(b''.join(self.conn.peek_output(100)), b'cdefg')
+        # Partial send across buffers
+        self.conn.consume_output(3)
+        self.assertEqual(len(self.conn.output), 1)
+        self.assertEqual(b''.join(self.conn.peek_output(100)), b'fg')
+        self.conn.consume_output(2)
+        self.assertFalse(self.conn.writing())
+        self.assertEqual(self.conn.output_offset, 0)
+
+    def test_output_limit(self):
+        self.init()
+        for i in range(connection.MAX_BUFFERS + 10):
+            self.conn.write(b'x' * 10)
+        self.assertEqual(len(self.conn.peek_output(25)), 3)
+        self.assertEqual(len(self.conn.peek_output(10**6)), connection.MAX_BUFFERS)
+
+    def test_window(self):
+        self.init(window=2)
+        # One packet until the router accepts the client
+        self.conn.request_sent()
+        self.assertFalse(self.conn.reading())
+        self.conn.acknowledge()
+        self.assertTrue(self.conn.reading())
+        self.conn.request_sent()
+        self.conn.request_sent()
+        self.assertFalse(self.conn.reading())
+        # Unsolicited responses do not free a slot
+        self.conn.acknowledge(answer=False)
+        self.assertEqual(self.conn.in_flight, 2)
+        self.assertFalse(self.conn.reading())
+        self.conn.acknowledge()
+        self.assertTrue(self.conn.reading())
+
+    def test_pause(self):
+        self.init()
+        self.conn.pause()
+        self.assertFalse(self.conn.reading())
+        self.conn.acknowledge(answer=False)
+        self.assertTrue(self.conn.reading())
+        self.assertEqual(self.conn.in_flight, 0)
+
+    # Paused clients are bound by the pause timeout instead of keep alive
+    def test_pause_timeout(self):
+        self.init()
+        self.conn.keep_alive = 10
+        self.conn.pause()
+        self.assertEqual(self.conn.timeout(30, 300), 300)
+        self.conn.acknowledge(answer=False)
+        self.assertEqual(self.conn.timeout(30, 300), 15)
+
+    def test_read_size(self):
+        self.init()
+        self.conn.adapt_read_size(connection.MIN_READ_SIZE)
+        self.assertEqual(self.conn.read_size, connection.MIN_READ_SIZE * 2)
+        for i in range(20):
+            self.conn.adapt_read_size(self.conn.read_size)
+        self.assertEqual(self.conn.read_size, connection.MAX_READ_SIZE)
+        for i in range(20):
+            self.conn.adapt_read_size(1)
+        self.assertEqual(self.conn.read_size, connection.MIN_READ_SIZE)
+
+if __name__ == '__main__':
+    unittest.main()
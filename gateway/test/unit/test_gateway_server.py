@@ -0,0 +1,267 @@
+import os
+import ssl
+import time
+import queue
+import json
+import socket
+import unittest
+import threading
+import urllib.request
+
+from app import gateway_server
+from app import metrics_server
+from app import token_bucket
+from app.protocols import mqtt as protocol
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+CONNECT = protocol.dump(protocol.compose({'type': 'connect', 'keep_alive': 1, 'client_id': 'a',
+                                          'clean_start': True, 'protocol_name': 'MQTT',
+                                          'protocol_version': 5, 'properties': {}}))
+PUBLISH = protocol.dump(protocol.compose({'type': 'publish', 'topic': 't', 'payload': b'hi'}))
+
+class Mailer:
+    def __init__(self):
+        self.inbox = queue.Queue()
+        self.requests = queue.Queue()
+        self.disconnects = queue.Queue()
+        self.notify = None
+
+    def set_notify(self, notify):
+        self.notify = notify
+
+    def empty(self):
+        return self.inbox.empty()
+
+    def size(self):
+        return self.inbox.qsize()
+
+    def get_batch(self, limit):
+        batch = []
+        while len(batch) < limit and not self.inbox.empty():
+            batch.append(self.inbox.get())
+        return batch
+
+    def put(self, packet, fd, state):
+        self.inbox.put((packet, fd, state))
+        self.notify()
+
+    def publish_request(self, packet, file_descriptor):
+        self.requests.put((packet, file_descriptor))
+
+    def publish_disconnect(self, file_descriptor):
+        self.disconnects.put(file_descriptor)
+
+class TestGatewayServer(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        # Certificate and key are loaded from the working directory
+        os.chdir(APP_DIR)
+        self.connect_timeout = gateway_server.CONNECT_TIMEOUT_IN_SECONDS
+        gateway_server.CONNECT_TIMEOUT_IN_SECONDS = 1
+        self.mailer = Mailer()
+        self.gateway = gateway_server.GatewayServer('127.0.0.1', protocol, self.mailer, window=4)
+        self.thread = threading.Thread(target=self.gateway.start, daemon=True)
+        self.thread.start()
+        time.sleep(0.2)
+
+    def tearDown(self):
+        self.gateway.stop()
+        self.thread.join(2)
+        os.chdir(self.cwd)
+        gateway_server.CONNECT_TIMEOUT_IN_SECONDS = self.connect_timeout
+
+    def connect(self, tls=False):
+        client = socket.create_connection(('127.0.0.1', protocol.port_safe if tls else protocol.port))
+        if tls:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            client = context.wrap_socket(client)
+        client.settimeout(2)
+        return client
+
+    def test_publish_and_reply(self):
+        client = self.connect()
+        client.sendall(PUBLISH)
+        packet, fd = self.mailer.requests.get(timeout=2)
+        self.assertEqual(packet['topic'], 't')
+        self.mailer.put({'type': 'pingresp', 'answer': True}, fd, 'read')
+        self.assertEqual(client.recv(10), b'\xd0\x00')
+        client.close()
+
+    def connect_mqtt(self):
+        client = self.connect()
+        client.sendall(CONNECT)
+        packet, fd = self.mailer.requests.get(timeout=2)
+        self.assertEqual(packet['keep_alive'], 1)
+        return client, fd
+
+    def assert_disconnected(self, client, fd):
+        client.settimeout(4)
+        self.assertEqual(self.mailer.disconnects.get(timeout=4), fd)
+        self.assertEqual(client.recv(10), b'')
+        self.assertNotIn(fd, self.gateway.connections)
+        client.close()
+
+    def test_keep_alive(self):
+        client, fd = self.connect_mqtt()
+        self.assert_disconnected(client, fd)
+
+    # Paused clients outlive their keep alive, up to the authentication timeout
+    def test_keep_alive_paused(self):
+        auth_timeout = gateway_server.AUTH_TIMEOUT_IN_SECONDS
+        gateway_server.AUTH_TIMEOUT_IN_SECONDS = 3
+        try:
+            client, fd = self.connect_mqtt()
+            self.mailer.put({'type': 'auth', 'code': 0x18, 'answer': True,
+                             'properties': {'authentication_method': 'OAuth2.0'}}, fd, 'idle')
+            self.assertEqual(client.recv(100)[0], 0xf0)
+            time.sleep(2)
+            self.assertTrue(self.mailer.disconnects.empty())
+            self.assertIn(fd, self.gateway.connections)
+            self.assert_disconnected(client, fd)
+        finally:
+            gateway_server.AUTH_TIMEOUT_IN_SECONDS = auth_timeout
+
+    # Keep alive is enforced again once reading resumes
+    def test_keep_alive_resumed(self):
+        client, fd = self.connect_mqtt()
+        self.mailer.put({'type': 'auth', 'code': 0x18, 'answer': True,
+                         'properties': {'authentication_method': 'OAuth2.0'}}, fd, 'idle')
+        self.assertEqual(client.recv(100)[0], 0xf0)
+        time.sleep(2)
+        self.mailer.put({'type': 'connack', 'code': 0, 'session_present': False,
+                         'properties': {}}, fd, 'read')
+        self.assertEqual(client.recv(5), b'\x20\x03\x00\x00\x00')
+        started = time.monotonic()
+        self.assert_disconnected(client, fd)
+        self.assertLess(time.monotonic() - started, 3)
+
+    def test_local_pingresp(self):
+        client, fd = self.connect_mqtt()
+        # Waits for CONNACK, then is answered without the router
+        client.sendall(b'\xc0\x00')
+        self.mailer.put({'type': 'connack', 'code': 0, 'session_present': False,
+                         'properties': {}, 'answer': True}, fd, 'read')
+        self.assertEqual(client.recv(7), b'\x20\x03\x00\x00\x00\xd0\x00')
+        client.sendall(b'\xc0\x00' * 3)
+        self.assertEqual(client.recv(6), b'\xd0\x00' * 3)
+        self.assertTrue(self.mailer.requests.empty())
+        client.close()
+
+    def test_server_busy(self):
+        self.gateway.connect_bucket = token_bucket.TokenBucket(0.001, 1, time.monotonic())
+        clients = [self.connect() for i in range(3)]
+        for client in clients: client.sendall(CONNECT)
+        self.mailer.requests.get(timeout=2)
+        refused = []
+        for client in clients:
+            client.settimeout(0.5)
+            try:
+                data = client.recv(100)
+            except socket.timeout:
+                continue
+            refused.append(client)
+            self.assertEqual(data[0], 0x20)
+            self.assertEqual(data[3], 0x89)
+            self.assertIn(b'retry-after', data)
+        self.assertEqual(len(refused), 2)
+        self.assertTrue(self.mailer.requests.empty())
+        # Refused clients are closed without telling the router
+        for client in refused:
+            self.assertEqual(client.recv(100), b'')
+        self.assertTrue(self.mailer.disconnects.empty())
+        self.assertEqual(len(self.gateway.connections), 1)
+        for client in clients: client.close()
+
+    def test_fan_out(self):
+        clients = [self.connect() for i in range(3)]
+        time.sleep(0.1)
+        message = {'type': 'publish', 'topic': 't', 'qos': 1, 'payload': b'x' * 1000,
+                   'properties': {}}
+        for index, fd in enumerate(sorted(self.gateway.connections)):
+            self.mailer.inbox.put((dict(message, id=index + 1), fd, None))
+        self.mailer.notify()
+        for index, client in enumerate(clients):
+            expected = protocol.dump(protocol.compose(dict(message, id=index + 1)))
+            data = b''
+            while len(data) < len(expected):
+                data += client.recv(2048)
+            self.assertEqual(data, expected)
+            client.close()
+
+    def test_pipelined_segment(self):
+        client, fd = self.connect_mqtt()
+        self.mailer.put({'type': 'connack', 'code': 0, 'session_present': False,
+                         'properties': {}, 'answer': True}, fd, 'read')
+        client.sendall(PUBLISH * 10)
+        published = 0
+        while published < 10:
+            self.mailer.requests.get(timeout=2)
+            published += 1
+            # Window of 4 packets in flight
+            if published % 4 == 0 or published == 10:
+                self.assertTrue(self.mailer.requests.empty())
+                for i in range(4):
+                    self.mailer.put({'answer': True}, fd, 'read')
+        client.close()
+
+    def test_malformed_length(self):
+        client = self.connect()
+        client.sendall(b'\x30\x80\x80\x80\x80\x01')
+        self.assertEqual(client.recv(10), b'\xe0\x02\x81\x00')
+        self.assertEqual(client.recv(10), b'')
+        self.mailer.disconnects.get(timeout=2)
+        self.assertTrue(self.mailer.requests.empty())
+        client.close()
+
+    def test_metrics_endpoint(self):
+        endpoint = metrics_server.MetricsServer('127.0.0.1', 0, self.gateway.metrics.snapshot)
+        endpoint.start()
+        client = self.connect()
+        client.sendall(PUBLISH)
+        packet, fd = self.mailer.requests.get(timeout=2)
+        self.mailer.put({'type': 'pingresp', 'answer': True}, fd, 'read')
+        self.assertEqual(client.recv(10), b'\xd0\x00')
+        time.sleep(0.1)
+        url = 'http://127.0.0.1:%s/metrics' % endpoint.port
+        with urllib.request.urlopen(url, timeout=2) as response:
+            values = json.loads(response.read())
+        endpoint.close()
+        self.assertEqual(values['gauges']['connections_plain'], 1)
+        self.assertEqual(values['counters']['accepted'], 1)
+        self.assertEqual(values['counters']['bytes_in'], len(PUBLISH))
+        self.assertEqual(values['counters']['bytes_out'], 2)
+        self.assertEqual(values['counters']['packets_in_publish'], 1)
+        self.assertEqual(values['counters']['packets_out_pingresp'], 1)
+        self.assertEqual(sum(values['histograms']['latency_publish']['counts']), 1)
+        client.close()
+
+    def test_bad_tls_record(self):
+        client = self.connect(tls=True)
+        raw = socket.socket(fileno=os.dup(client.fileno()))
+        raw.settimeout(2)
+        # Application data record that fails decryption
+        raw.sendall(b'\x17\x03\x03\x00\x20' + b'\x01' * 32)
+        self.mailer.disconnects.get(timeout=2)
+        self.assertTrue(self.thread.is_alive())
+        other = self.connect()
+        other.sendall(PUBLISH)
+        self.mailer.requests.get(timeout=2)
+        raw.close()
+        client.close()
+        other.close()
+
+    def test_handshake_timeout(self):
+        # Never starts the TLS handshake
+        client = socket.create_connection(('127.0.0.1', protocol.port_safe))
+        client.settimeout(4)
+        self.assertEqual(client.recv(10), b'')
+        self.assertFalse(self.gateway.handshakes)
+        self.assertEqual(len(self.gateway.timers), 0)
+        client.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import unittest
+
+os.environ['AMQP_URL'] = 'AMQP_URL'
+os.environ['ROUTING_SERVICE'] = 'ROUTER'
+
+from app import inbox_service
+
+class Properties:
+    def __init__(self, correlation_id):
+        self.correlation_id = correlation_id
+
+class TestInboxService(unittest.TestCase):
+
+    def init(self):
+        self.notified = 0
+        self.service = inbox_service.InboxService()
+        self.service.set_notify(self.notify)
+
+    def notify(self):
+        self.notified += 1
+
+    def receive(self, fd, state='read'):
+        self.service.receive_package({'state': state, 'type': 'puback'}, Properties(str(fd)))
+
+    def test_receive(self):
+        self.init()
+        self.assertTrue(self.service.empty())
+        self.receive(7, 'idle')
+        self.assertEqual(self.notified, 1)
+        self.assertFalse(self.service.empty())
+        self.assertEqual(self.service.get_batch(10), [({'type': 'puback'}, 7, 'idle')])
+
+    def test_batch(self):
+        self.init()
+        for fd in range(5):
+            self.receive(fd)
+        batch = self.service.get_batch(3)
+        self.assertEqual([fd for packet, fd, state in batch], [0, 1, 2])
+        batch = self.service.get_batch(3)
+        self.assertEqual([fd for packet, fd, state in batch], [3, 4])
+        self.assertEqual(self.service.get_batch(3), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from app import metrics
+
+class TestMetrics(unittest.TestCase):
+
+    def test_rate(self):
+        values = metrics.Metrics()
+        for now in [10.1, 10.5, 10.9, 11.2]:
+            values.mark('accepts', now)
+        self.assertEqual(values.rate('accepts', 11.5), 3)
+        self.assertEqual(values.rate('accepts', 12.5), 1)
+        self.assertEqual(values.rate('accepts', 14), 0)
+        values.mark('accepts', 14)
+        self.assertEqual(values.rate('accepts', 14.5), 0)
+
+    def test_histogram(self):
+        values = metrics.Metrics()
+        for value in [0.0005, 0.001, 0.003, 20]:
+            values.observe('latency', value)
+        histogram = values.snapshot()['histograms']['latency']
+        self.assertEqual(histogram['counts'][0], 2)
+        self.assertEqual(histogram['counts'][2], 1)
+        self.assertEqual(histogram['counts'][-1], 1)
+        self.assertAlmostEqual(histogram['sum'], 20.0045)
+
+    def test_gauges(self):
+        values = metrics.Metrics()
+        values.add('connections', 2)
+        values.add('connections', -1)
+        values.set('limit', 8)
+        self.assertEqual(values.snapshot()['gauges'], {'connections': 1, 'limit': 8})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from app import metrics
+from app import supervisor
+
+# Worker exiting right away, restarted by the supervisor
+def exit_worker(index, stats):
+    pass
+
+class TestSupervisor(unittest.TestCase):
+
+    def test_aggregate(self):
+        sup = supervisor.Supervisor(2, exit_worker)
+        for index, batch in enumerate([10, 30]):
+            worker = metrics.Metrics()
+            worker.inc('inbox_messages', batch)
+            worker.set('inbox_batch_limit', 256)
+            worker.set('inbox_last_batch', batch)
+            worker.add('connections_plain', index + 2)
+            worker.observe('latency_publish', 0.002 * (index + 1))
+            sup.snapshots[index] = worker.snapshot()
+        totals = sup.aggregate()
+        self.assertEqual(totals['counters']['inbox_messages'], 40)
+        self.assertEqual(totals['gauges']['inbox_batch_limit'], 256)
+        self.assertEqual(totals['gauges']['inbox_last_batch'], 30)
+        self.assertEqual(totals['workers'][0]['inbox_last_batch'], 10)
+        # Load gauges add up to fleet totals
+        self.assertEqual(totals['gauges']['connections_plain'], 5)
+        histogram = totals['histograms']['latency_publish']
+        self.assertEqual(sum(histogram['counts']), 2)
+        self.assertAlmostEqual(histogram['sum'], 0.006)
+
+    def test_restart(self):
+        sup = supervisor.Supervisor(1, exit_worker)
+        sup.spawn(0)
+        worker = metrics.Metrics()
+        worker.inc('packets_in_publish', 7)
+        worker.observe('latency_publish', 0.002)
+        sup.snapshots[0] = worker.snapshot()
+        sup.processes[0].join(5)
+        first = sup.processes[0]
+        sup.check()
+        self.assertEqual(sup.restarts, 1)
+        self.assertNotIn(0, sup.snapshots)
+        self.assertIsNot(sup.processes[0], first)
+        self.assertEqual(sup.aggregate()['counters']['worker_restarts'], 1)
+        # Counters of the exited worker stay in the totals
+        sup.snapshots[0] = worker.snapshot()
+        totals = sup.aggregate()
+        self.assertEqual(totals['counters']['packets_in_publish'], 14)
+        self.assertEqual(sum(totals['histograms']['latency_publish']['counts']), 2)
+        sup.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from app import timer_wheel
+
+class TestTimerWheel(unittest.TestCase):
+
+    def advance_until_empty(self, wheel, now):
+        fired = {}
+        while len(wheel) > 0:
+            now += wheel.next_timeout(now)
+            for key in wheel.advance(now):
+                fired[key] = now
+        return fired
+
+    def test_expire(self):
+        wheel = timer_wheel.TimerWheel(100.5)
+        deadlines = {'a': 101.2, 'b': 130, 'c': 100.5 + 5000, 'd': 100.5 + 20000000}
+        for key, deadline in deadlines.items():
+            wheel.schedule(key, deadline)
+        fired = self.advance_until_empty(wheel, 100.5)
+        self.assertEqual(set(fired), set(deadlines))
+        for key, deadline in deadlines.items():
+            self.assertGreaterEqual(fired[key], deadline)
+            self.assertLessEqual(fired[key], deadline + 1)
+
+    def test_cancel(self):
+        wheel = timer_wheel.TimerWheel(0)
+        wheel.schedule('a', 10)
+        wheel.schedule('b', 10)
+        wheel.cancel('a')
+        self.assertNotIn('a', wheel)
+        self.assertEqual(wheel.advance(10), ['b'])
+        self.assertIsNone(wheel.next_timeout(10))
+
+    def test_reschedule(self):
+        wheel = timer_wheel.TimerWheel(0)
+        wheel.schedule('a', 10)
+        wheel.schedule('a', 100)
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.advance(50), [])
+        self.assertEqual(wheel.advance(100), ['a'])
+
+    def test_past_deadline(self):
+        wheel = timer_wheel.TimerWheel(0)
+        wheel.advance(10)
+        wheel.schedule('a', 5)
+        self.assertEqual(wheel.next_timeout(10.5), 0.5)
+        self.assertEqual(wheel.advance(11), ['a'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+import unittest
+
+from app import token_bucket
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst(self):
+        bucket = token_bucket.TokenBucket(10, 3, 0)
+        self.assertEqual([bucket.take(0) for i in range(4)], [True, True, True, False])
+
+    def test_refill(self):
+        bucket = token_bucket.TokenBucket(10, 3, 0)
+        for i in range(3): bucket.take(0)
+        self.assertFalse(bucket.take(0.05))
+        self.assertTrue(bucket.take(0.1))
+        self.assertFalse(bucket.take(0.1))
+        # Never more than burst tokens
+        self.assertEqual(sum(bucket.take(100) for i in range(5)), 3)
+
+if __name__ == '__main__':
+    unittest.main()
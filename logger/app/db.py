@@ -2,6 +2,7 @@ import psycopg2
 from psycopg2 import OperationalError
 import os
 import logging
+import threading
 
 LOGGER = logging.getLogger(__name__)
 
@@ -124,11 +125,26 @@ REVOKE_SELECT_OWNERSHIP = """
 class Database:
 
     def __init__(self, dsn):
-        self.connection = psycopg2.connect(dsn)
-        self.connection.autocommit = True
+        self.dsn = dsn
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
         cursor = self.connection.cursor()
         cursor.execute(CREATE_TABLE)
 
+    # Connection of the calling thread, opened on first use, so service
+    # workers query in parallel instead of queueing on one connection
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = psycopg2.connect(self.dsn)
+            connection.autocommit = True
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
     def insert(self, user, resource, action, success,):
         # owner = owner.replace('@', '_at_').replace('.', '_dot_')
         # cursor = self.connection.cursor()
@@ -2,6 +2,7 @@ import psycopg2
 from psycopg2 import OperationalError
 import os
 import random
+import threading
 
 CHARS = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
@@ -62,11 +63,26 @@ UPDATE = """
 class Database:
 
     def __init__(self, dsn):
-        self.connection = psycopg2.connect(dsn)
-        self.connection.autocommit = True
+        self.dsn = dsn
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
         cursor = self.connection.cursor()
         cursor.execute(CREATE_TABLE)
 
+    # Connection of the calling thread, opened on first use, so service
+    # workers query in parallel instead of queueing on one connection
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = psycopg2.connect(self.dsn)
+            connection.autocommit = True
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
     def delete(self, cid):
         cursor = self.connection.cursor()
         cursor.execute(DELETE, (cid,))
@@ -107,7 +123,10 @@ class Database:
         cursor.execute(UPDATE, (conn.get_email(), conn.get_id()))
 
     def close(self):
-        self.connection.close()
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
 
 class Connection:
 
@@ -1,6 +1,7 @@
 
 import os
 import logging
+import threading
 import time
 
 import abstract_service
@@ -37,6 +38,7 @@ class Service(abstract_service.AbstractService):
     def __init__(self, queue, db, dummy_messenger=None):
         self.db = db
         self.dummy_messenger = dummy_messenger
+        self.local = threading.local()
         abstract_service.AbstractService.__init__(self, queue)
         self.actions = {'disconnect': self.disconnect,
                         'process': self.process,
@@ -44,6 +46,15 @@ class Service(abstract_service.AbstractService):
                         'verify': self.verify,
                         'forward': self.forward,}
 
+    # Connection of the request being processed, one per worker thread
+    @property
+    def conn(self):
+        return getattr(self.local, 'conn', None)
+
+    @conn.setter
+    def conn(self, value):
+        self.local.conn = value
+
     def prepare_action(self, request, props):
         cid = props.correlation_id
         self.conn = self.db.get(cid)
@@ -65,8 +76,14 @@ class Service(abstract_service.AbstractService):
         LOGGER.info('Disconnecting client %s', props.correlation_id)
         self.db.delete_by_socket(props.correlation_id, props.reply_to)
 
-    # Process and route client package
+    # Process client package, the response answers the client request
     def process(self, request, props):
+        response = self.route(request, props)
+        if response is not None: response['answer'] = True
+        return response
+
+    # Route client package
+    def route(self, request, props):
         self.conn = self.db.get_by_socket(props.correlation_id, props.reply_to)
         client_connected = self.conn.connected()
         packet_type = request.get('type')
@@ -192,15 +209,17 @@ class Service(abstract_service.AbstractService):
             self.redirect(service, request)
 
         properties = {'assigned_client_identifier': cid} if self.conn.get_random_id() else {}
+        # Answer to the CONNECT request of the client
         return {'state': 'read',
+                'answer': True,
                 'type': 'connack',
                 'code': SUCCESS,
                 'session_present': session_present,
                 'properties': properties,}
 
-    # Forward message from other service to client
+    # Forward message from other service to client, without answering a client request
     def forward(self, request, props):
-        request['state'] = 'read'
+        request['state'] = 'forward'
         return request
 
     def redirect(self, target, request, reply=False):
@@ -2,6 +2,7 @@
 import os
 import time
 import logging
+import threading
 
 import abstract_service
 
@@ -45,6 +46,7 @@ class Service(abstract_service.AbstractService):
     def __init__(self, queue, db, expiry_table, dummy_messenger=None):
         self.db = db
         self.dummy_messenger = dummy_messenger
+        self.local = threading.local()
         self.expiry_table = expiry_table
         abstract_service.AbstractService.__init__(self, queue)
         self.actions = {'publish': self._publish,
@@ -57,6 +59,15 @@ class Service(abstract_service.AbstractService):
                         'get_subscriptions': self.get_subscriptions,
                         'delete_subscription': self.delete_subscription,}
 
+    # Session of the request being processed, one per worker thread
+    @property
+    def session(self):
+        return getattr(self.local, 'session', None)
+
+    @session.setter
+    def session(self, value):
+        self.local.session = value
+
     def prepare_action(self, request, props):
         cid = props.correlation_id
         self.session = self.db.get(cid)